@@ -0,0 +1,303 @@
+"""
+trigger and admin API benchmarks against the stand-in server.
+
+Every worker is run with every transport variant; results are written as
+JSON (stdout or --output) so runs can be compared by scripts:
+
+    PYTHONPATH=src python -m benchmarks.run --events 5000 --latency 2 --output results.json
+    PYTHONPATH=src python -m benchmarks.run --workers background,pooled --transports default,orjson
+
+The server runs in a subprocess, so `cpu_ms_per_send` is the SDK process
+time only. Use --server to point to an already running stand-in server.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Optional
+
+import requests
+
+from bitcaster_sdk.client import Client
+from bitcaster_sdk.exceptions import ConfigurationError
+from bitcaster_sdk.sdk import Bitcaster
+from bitcaster_sdk.worker import (BackgroundWorker, BatchWorker, PooledWorker,
+                                  SynchronousWorker)
+
+# short backoffs: injected errors must not stall the run for seconds
+RETRY = {'backoff': 0.01, 'max_backoff': 0.2, 'max_attempts': 10}
+
+WORKERS = {
+    'sync': lambda n: SynchronousWorker(),
+    'background': lambda n: BackgroundWorker(dict(RETRY, queue_size=n + 10)),
+    'pooled': lambda n: PooledWorker(dict(RETRY, queue_size=n + 10, min_threads=4, max_threads=4)),
+    'batch': lambda n: BatchWorker(dict(RETRY, queue_size=n + 10, batch_size=50, batch_interval=20)),
+}
+
+TRANSPORTS = {
+    'default': {},
+    'no_keep_alive': {'keep_alive': False},
+    'orjson': {'serializer': 'orjson'},
+    'gzip': {'compress_threshold': 0},
+    'pool_1': {'pool_maxsize': 1, 'pool_block': True},
+}
+
+CONTEXT = {'user': 'user@example.com', 'code': '123456', 'items': list(range(20))}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def summary(seconds):
+    # seconds -> {'p50': ms, 'p99': ms, 'max': ms}
+    ms = [s * 1000 for s in seconds]
+    return {'p50': percentile(ms, 50), 'p99': percentile(ms, 99), 'max': max(ms) if ms else None}
+
+
+class RemoteServer:
+    # the stand-in server running in another process (or anywhere)
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        host = self.url.split('://', 1)[1]
+        self.aep = f'http://key-bench@{host}/api/o/bitcaster/a/38/'
+        self.sdt = f'http://sdk-bench@{host}/api/o/bitcaster/'
+
+    def reset(self):
+        self.session.post(f'{self.url}/__reset__').raise_for_status()
+
+    def stats(self):
+        return self.session.get(f'{self.url}/__stats__').json()
+
+    def wait_for(self, triggers, timeout):
+        # the server may still be processing the last requests
+        deadline = time.time() + timeout
+        stats = self.stats()
+        while stats['triggers'] < triggers and time.time() < deadline:
+            time.sleep(0.05)
+            stats = self.stats()
+        return stats
+
+
+def spawn_server(args):
+    cmd = [sys.executable, '-m', 'benchmarks.server', '--port', '0',
+           '--latency', str(args.latency), '--jitter', str(args.jitter),
+           '--error-rate', str(args.error_rate), '--throttle-rate', str(args.throttle_rate),
+           '--retry-after', str(args.retry_after)]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, cwd=ROOT, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith('listening on '):
+        proc.kill()
+        raise RuntimeError(f'unable to start the stand-in server: {line!r}')
+    return proc, line.split('listening on ', 1)[1].strip()
+
+
+def drain(worker, timeout):
+    # type: (...) -> bool
+    if isinstance(worker, SynchronousWorker):
+        return True
+    return worker._timed_queue_join(timeout)
+
+
+def run_triggers(server, worker_name, transport_name, events, rate=None, timeout=60):
+    # type: (RemoteServer, str, str, int, Optional[float], float) -> dict
+    # `rate`: events queued per second, None for a single burst
+    worker = WORKERS[worker_name](events)
+    failed = []
+    if not isinstance(worker, SynchronousWorker):
+        worker.options['dead_letter'] = lambda callback, exc: failed.append(exc)
+    server.reset()
+    client = Client(server.aep, worker=worker, **TRANSPORTS[transport_name])
+    enqueue = []
+    errors = 0
+    cpu, start = time.process_time(), time.perf_counter()
+    for i in range(events):
+        if rate:
+            wait = start + i / rate - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        context = dict(CONTEXT, _t=time.time())
+        t = time.perf_counter()
+        try:
+            client.queue(1, context)
+        except Exception:
+            # SynchronousWorker sends inline and raises on injected errors
+            errors += 1
+        enqueue.append(time.perf_counter() - t)
+    drained = drain(worker, timeout)
+    elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+    stats = server.wait_for(events - errors - len(failed), 5)
+    client.terminate()
+    delivered = stats['triggers']
+    return {'kind': 'trigger',
+            'worker': worker_name,
+            'transport': transport_name,
+            'events': events,
+            'rate': rate,
+            'delivered': delivered,
+            'errors': errors,
+            'failed': len(failed),
+            'dropped': dict(getattr(worker, 'dropped', {})),
+            'drained': drained,
+            'seconds': elapsed,
+            'triggers_per_sec': delivered / elapsed if elapsed else None,
+            'enqueue_ms': summary(enqueue),
+            'delivery_ms': summary(stats['latencies']),
+            'cpu_ms_per_send': cpu * 1000 / delivered if delivered else None,
+            'bytes_per_send': stats['bytes'] / delivered if delivered else None,
+            'requests': stats['requests'],
+            'statuses': stats['statuses'],
+            'pool': client.transport.pool_stats()}
+
+
+def queued_memory(server, worker_name, transport_name, events):
+    # type: (RemoteServer, str, str, int) -> float
+    # bytes held per queued event: the worker is kept busy while queueing
+    worker = WORKERS[worker_name](events)
+    client = Client(server.aep, worker=worker, **TRANSPORTS[transport_name])
+    gate = threading.Event()
+    busy = [threading.Event() for __ in range(getattr(worker, 'options', {}).get('min_threads', 1))]
+    for flag in busy:
+        worker.submit(lambda flag=flag: flag.set() or gate.wait(30))
+    for flag in busy:
+        flag.wait(5)
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for __ in range(events):
+            client.queue(1, dict(CONTEXT, _t=time.time()))
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+        gate.set()
+    grown = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    drain(worker, 60)
+    client.terminate()
+    return grown / events
+
+
+def run_admin(server, calls):
+    # type: (RemoteServer, int) -> list
+    sdk = Bitcaster(server.sdt)
+    ret = []
+    for name, call in (('ping', lambda: sdk.session.get(sdk.ping_url)),
+                       ('get_members', sdk.get_members),
+                       ('filter_streams', lambda: sdk.filter_streams(38))):
+        server.reset()
+        latencies = []
+        cpu, start = time.process_time(), time.perf_counter()
+        for __ in range(calls):
+            t = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - t)
+        elapsed, cpu = time.perf_counter() - start, time.process_time() - cpu
+        ret.append({'kind': 'admin',
+                    'call': name,
+                    'calls': calls,
+                    'seconds': elapsed,
+                    'calls_per_sec': calls / elapsed if elapsed else None,
+                    'latency_ms': summary(latencies),
+                    'cpu_ms_per_call': cpu * 1000 / calls if calls else None,
+                    'statuses': server.stats()['statuses']})
+    return ret
+
+
+def run(server, workers, transports, events, rate=None, admin_calls=0, memory=True):
+    # type: (RemoteServer, list, list, int, Optional[float], int, bool) -> list
+    results = []
+    for worker_name in workers:
+        for transport_name in transports:
+            try:
+                result = run_triggers(server, worker_name, transport_name, events, rate)
+            except ConfigurationError as e:  # eg. orjson not installed
+                results.append({'kind': 'trigger', 'worker': worker_name, 'transport': transport_name,
+                                'skipped': str(e)})
+                continue
+            if memory and worker_name != 'sync':
+                result['memory_bytes_per_event'] = queued_memory(server, worker_name, transport_name,
+                                                                 min(events, 1000))
+            results.append(result)
+    if admin_calls:
+        results.extend(run_admin(server, admin_calls))
+    return results
+
+
+def parse_list(value, choices):
+    items = [v.strip() for v in value.split(',') if v.strip()]
+    for item in items:
+        if item not in choices:
+            raise argparse.ArgumentTypeError(f'"{item}" is not one of {", ".join(choices)}')
+    return items
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='bitcaster-sdk benchmarks')
+    parser.add_argument('--server', help='url of a running stand-in server (default: start one)')
+    parser.add_argument('--events', type=int, default=2000, help='triggers per scenario')
+    parser.add_argument('--rate', type=float, help='events queued per second (default: a single burst)')
+    parser.add_argument('--admin-calls', type=int, default=200, help='calls per admin endpoint, 0 to skip')
+    parser.add_argument('--workers', default=','.join(WORKERS), type=lambda v: parse_list(v, WORKERS))
+    parser.add_argument('--transports', default=','.join(TRANSPORTS), type=lambda v: parse_list(v, TRANSPORTS))
+    parser.add_argument('--no-memory', action='store_true', help='skip the queued memory measure')
+    parser.add_argument('--latency', type=float, default=0, help='server latency, milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0, help='rate of 429 responses')
+    parser.add_argument('--retry-after', type=float, default=0.05, help='seconds, for 429 responses')
+    parser.add_argument('--output', help='json file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    proc = None
+    if args.server:
+        url = args.server
+    else:
+        proc, url = spawn_server(args)
+    try:
+        results = run(RemoteServer(url), args.workers, args.transports, args.events,
+                      args.rate, args.admin_calls, not args.no_memory)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait(5)
+
+    report = {'meta': {'revision': revision(),
+                       'python': platform.python_version(),
+                       'implementation': platform.python_implementation(),
+                       'platform': platform.platform(),
+                       'cpus': os.cpu_count(),
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime())},
+              'server': {'url': url, 'latency_ms': args.latency, 'jitter_ms': args.jitter,
+                         'error_rate': args.error_rate, 'throttle_rate': args.throttle_rate,
+                         'retry_after': args.retry_after},
+              'results': results}
+    data = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(data)
+    else:
+        print(data)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
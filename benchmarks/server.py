@@ -0,0 +1,207 @@
+"""
+stand-in Bitcaster server for benchmarks.
+
+Answers the ping, trigger and a few admin endpoints with HTTP/1.1
+keep-alive, with configurable latency, error rate and 429 injection.
+Delivery latency is measured from the `_t` (time.time()) value found in
+JSON trigger bodies.
+
+    python -m benchmarks.server --port 8900 --latency 5 --error-rate 0.01 --throttle-rate 0.05
+
+GET /__stats__ returns the counters, POST /__reset__ clears them.
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import re
+import threading
+import time
+
+PING = {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'}
+STREAMS = [{'id': i, 'slug': f'stream-{i}', 'name': f'Stream {i}'} for i in range(1, 11)]
+MEMBERS = [{'id': i, 'user': {'id': i, 'email': f'user{i}@example.com'}} for i in range(1, 101)]
+
+TRIGGER = re.compile(r'^/api/o/[^/]+/a/\d+/s/[^/]+/trigger/$')
+
+
+class Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.statuses = {}
+        self.triggers = 0
+        self.latencies = []  # delivery latencies, seconds
+        self.bytes = 0
+
+    def as_dict(self):
+        return {'requests': self.requests, 'statuses': self.statuses, 'triggers': self.triggers,
+                'bytes': self.bytes, 'latencies': self.latencies}
+
+
+class StandInServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 throttle_rate=0.0, retry_after=0.1):
+        # latency/jitter in milliseconds, rates in 0..1
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.stats = Stats()
+        self._loop = None
+        self._server = None
+        self._thread = None
+        self._ready = threading.Event()
+
+    @property
+    def url(self):
+        return f'http://{self.host}:{self.port}'
+
+    def aep(self, application=38):
+        return f'http://key-bench@{self.host}:{self.port}/api/o/bitcaster/a/{application}/'
+
+    def sdt(self):
+        return f'http://sdk-bench@{self.host}:{self.port}/api/o/bitcaster/'
+
+    def route(self, method, path, headers, body):
+        # returns (status, payload, extra headers)
+        path = path.split('?', 1)[0]
+        if path == '/__stats__':
+            return 200, self.stats.as_dict(), {}
+        if path == '/__reset__':
+            self.stats.reset()
+            return 200, {}, {}
+        if path == '/api/system/ping/':
+            return 200, PING, {}
+        if random.random() < self.throttle_rate:
+            return 429, {'time_left': self.retry_after}, {'Retry-After': str(self.retry_after)}
+        if random.random() < self.error_rate:
+            return 500, {'error': 'injected'}, {}
+        if method == 'POST' and TRIGGER.match(path):
+            self.stats.triggers += 1
+            self.stats.bytes += len(body)
+            if headers.get('content-encoding') == 'gzip':
+                body = gzip.decompress(body)
+            try:
+                sent = json.loads(body).get('_t')
+            except (ValueError, AttributeError):
+                sent = None
+            if sent:
+                self.stats.latencies.append(time.time() - sent)
+            return 201, {'message': 'Event triggered'}, {}
+        return self.admin(method, path)
+
+    def admin(self, method, path):
+        if path.endswith('/s/'):
+            return 200, STREAMS, {}
+        if path.endswith('/m/'):
+            return 200, {'results': MEMBERS, 'next': None}, {}
+        if path.endswith('/c/'):
+            return 200, [{'id': 1, 'name': 'email'}], {}
+        if method in ('POST', 'PUT', 'PATCH'):
+            return 201, {'id': 1}, {}
+        if method == 'DELETE':
+            return 204, None, {}
+        return 200, {'id': 1}, {}
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, __ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, value = line.decode().split(':', 1)
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get('content-length', 0))
+                body = await reader.readexactly(length) if length else b''
+                delay = self.latency + random.uniform(-self.jitter, self.jitter)
+                if delay > 0:
+                    await asyncio.sleep(delay / 1000.0)
+                status, payload, extra = self.route(method, path, headers, body)
+                self.stats.requests += 1
+                self.stats.statuses[str(status)] = self.stats.statuses.get(str(status), 0) + 1
+                data = b'' if payload is None else json.dumps(payload).encode()
+                head = [f'HTTP/1.1 {status} X', 'Content-Type: application/json', f'Content-Length: {len(data)}']
+                head += [f'{k}: {v}' for k, v in extra.items()]
+                close = headers.get('connection', '').lower() == 'close'
+                if close:
+                    head.append('Connection: close')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode() + data)
+                await writer.drain()
+                if close:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _listen(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def _shutdown(self):
+        self._server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.get_running_loop().stop()
+
+    def _run(self):
+        self._loop = asyncio.new_event_loop()
+        try:
+            self._loop.run_until_complete(self._listen())
+            self._ready.set()
+            self._loop.run_forever()
+        finally:
+            self._loop.close()
+
+    def start(self):
+        # in a background thread of this process
+        self._thread = threading.Thread(target=self._run, name='bitcaster-stand-in', daemon=True)
+        self._thread.start()
+        self._ready.wait(5)
+        return self
+
+    def stop(self):
+        if self._loop is not None and self._loop.is_running():
+            asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop)
+        if self._thread is not None:
+            self._thread.join(5)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='stand-in Bitcaster server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0, help='milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='milliseconds')
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--throttle-rate', type=float, default=0, help='rate of 429 responses')
+    parser.add_argument('--retry-after', type=float, default=0.1, help='seconds, for 429 responses')
+    args = parser.parse_args(argv)
+    server = StandInServer(args.host, args.port, args.latency, args.jitter, args.error_rate,
+                           args.throttle_rate, args.retry_after)
+    server.start()
+    # the runner reads the url (and the port, with --port 0) from this line
+    print(f'listening on {server.url}', flush=True)
+    try:
+        server._thread.join()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,13 +1,29 @@
+import importlib
 import os
 
-from . import client
-from .api import trigger
 from .logging import logger
 
 __all__ = ('trigger', 'logger')
 
 
+def __getattr__(name):
+    # submodules are imported on first access: `import bitcaster_sdk` must
+    # not load requests & co. for processes that only trigger events
+    try:
+        return importlib.import_module(f'.{name}', __name__)
+    except ModuleNotFoundError as e:
+        if e.name != f'{__name__}.{name}':
+            raise
+        raise AttributeError(f"module '{__name__}' has no attribute '{name}'") from None
+
+
 def init(*args, **kwargs):
+    from . import client
     bae = os.environ.get('BITCASTER_AEP')
     client.client = client.Client(bae, *args, **kwargs)
     return client.client
+
+
+def trigger(stream, arguments=None, priority=None):
+    from .api import trigger
+    return trigger(stream, arguments, priority)
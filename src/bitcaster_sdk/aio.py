@@ -0,0 +1,476 @@
+import asyncio
+import json
+import os
+import uuid
+from time import time
+from typing import Any
+from urllib.parse import urlencode, urlparse
+
+from . import metrics
+from .client import Client, Coalescer, Event, next_page
+from .exceptions import (ConfigurationError, Http404, RateLimited,
+                         RemoteAPIException, RequestTimeout, StreamNotFound)
+from .logging import logger
+from .ratelimit import RateLimiter, retry_after
+from .sdk import Bitcaster
+from .serializers import encode, get_serializer
+from .streams import StreamResolver
+from .transport import Transport, budget
+
+client = None
+
+
+def _aiohttp():
+    try:
+        import aiohttp
+    except ImportError:
+        raise ConfigurationError('asyncio support requires aiohttp. '
+                                 'Install it with "pip install bitcaster-sdk[async]"')
+    return aiohttp
+
+
+def _client_timeout(aiohttp, timeout):
+    connect, read = timeout
+    return aiohttp.ClientTimeout(total=None, sock_connect=connect, sock_read=read)
+
+
+class AsyncResponse:
+    # body is read before the aiohttp response is released,
+    # so this can be inspected like a `requests.Response`
+    def __init__(self, status_code, url, content, headers=None):
+        self.status_code = status_code
+        self.url = url
+        self.content = content
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+    def __repr__(self):
+        return f'<AsyncResponse [{self.status_code}]>'
+
+
+class AsyncTransport:
+    get_url = Transport.get_url
+
+    def __init__(self, base_url, token, **kwargs):
+        self.aiohttp = _aiohttp()
+        self.base_url = base_url
+        self.debug = kwargs.get('debug')
+        self.conn = urlparse(base_url)
+        self.headers = {'Authorization': f'Key {token}',
+                        'User-Agent': 'Bitcaster-SDK'}
+        self.options = kwargs
+        self.limiter = RateLimiter(kwargs.get('rate_limit'), kwargs.get('rate_burst'),
+                                   kwargs.get('stream_rate_limit'), kwargs.get('stream_rate_burst'))
+        self.timeout = (kwargs.get('connect_timeout', 5), kwargs.get('read_timeout', 30))
+        self.serializer = get_serializer(kwargs.get('serializer'))
+        self.compress_threshold = kwargs.get('compress_threshold')
+        self._session = None
+
+    @property
+    def session(self):
+        # created on first use, so that it is bound to the running loop
+        if self._session is None or self._session.closed:
+            connector = self.aiohttp.TCPConnector(limit=self.options.get('pool_maxsize', 10),
+                                                  limit_per_host=self.options.get('pool_maxsize', 10),
+                                                  force_close=not self.options.get('keep_alive', True))
+            self._session = self.aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self._session
+
+    async def _request(self, method, path, timeout=None, deadline=None, **kwargs):
+        timeout = _client_timeout(self.aiohttp, budget(timeout or self.timeout, deadline))
+        try:
+            async with self.session.request(method, self.get_url(path), timeout=timeout, **kwargs) as res:
+                content = await res.read()
+                return AsyncResponse(res.status, str(res.url), content, dict(res.headers))
+        except asyncio.TimeoutError as e:
+            raise RequestTimeout(f'Timeout contacting {path}') from e
+
+    def encode(self, arguments):
+        return encode(arguments, self.serializer, self.compress_threshold)
+
+    async def get(self, path, timeout=None, deadline=None):
+        if self.debug:
+            logger.info(f"get {path}")
+        return await self._request('GET', path, timeout, deadline)
+
+    async def post(self, path, arguments, stream=None, timeout=None, deadline=None, headers=None):
+        if self.debug:
+            logger.info(f"post {path}")
+        # waiting here only suspends this task, so always wait for a token
+        wait = self.limiter.reserve(stream)
+        while wait:
+            await asyncio.sleep(wait)
+            wait = self.limiter.reserve(stream)
+        payload = self.encode(arguments)
+        response = await self._request('POST', path, timeout, deadline, data=payload.body,
+                                       headers=dict(payload.headers, **(headers or {})))
+        if response.status_code == 429:
+            self.limiter.pause(retry_after(response), stream)
+        return response
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+class AsyncClient(Client):
+    """
+    asyncio counterpart of Client.
+
+    `send` is awaitable; `queue` puts the event in a bounded in-loop queue
+    drained by `concurrency` tasks sharing one connection pool.
+    """
+
+    def __init__(self, bae, debug=False, *args, **kwargs):
+        # type: (str, bool, *Any, **Any) -> None
+        self.bae = bae
+        self.options = {'debug': debug, 'queue_size': 100, 'concurrency': 10, 'max_attempts': 5}
+        self.options.update(kwargs)
+        self.parse_url(bae)
+        if self.options.get('metrics'):
+            metrics.enable()
+        self.transport = AsyncTransport(**self.options)
+        # without a configured resolver streams are fetched by `fetch_streams`
+        self.streams = self.options.get('streams') or StreamResolver(None)
+        self._streams_lock = None
+        self.coalescer = Coalescer(self.options['coalesce_window']) if self.options.get('coalesce_window') else None
+        self._queue = None
+        self._tasks = []
+
+    async def ping(self):
+        response = await self.transport.get('/api/system/ping/')
+        self.assert_response(response)
+
+    async def fetch_streams(self):
+        streams, path = [], 's/'
+        while path:
+            response = await self.transport.get(path)
+            self.assert_response(response)
+            data = response.json()
+            streams.extend(data['results'] if isinstance(data, dict) else data)
+            path = next_page(data)
+        return streams
+
+    async def resolve_stream(self, stream):
+        ret = self.streams.lookup(stream)
+        if ret is None:
+            generation = self.streams.generation
+            if self.streams.fetch is not None:
+                await asyncio.get_event_loop().run_in_executor(None, self.streams.refresh, generation)
+            else:
+                if self._streams_lock is None:
+                    self._streams_lock = asyncio.Lock()
+                async with self._streams_lock:
+                    if self.streams.stale(generation):
+                        self.streams.update(await self.fetch_streams())
+            ret = self.streams.lookup(stream)
+        if ret is None:
+            raise StreamNotFound(f'Unknown stream "{stream}"')
+        return ret
+
+    async def send(self, stream, context, timeout=None, deadline=None, headers=None):
+        stream = await self.resolve_stream(stream)
+        headers = dict(headers or {})
+        headers.setdefault('Idempotency-Key', uuid.uuid4().hex)
+        if self.debug:
+            logger.debug(f'sending to {stream}')
+        start, status = time(), 'error'
+        try:
+            response = await self.transport.post(f's/{stream}/trigger/', context, stream=stream,
+                                                 timeout=timeout, deadline=deadline, headers=headers)
+            status = response.status_code
+        finally:
+            metrics.SEND_SECONDS.observe(time() - start, stream=stream, status=status)
+        self.assert_response(response)
+        return response
+
+    def _ensure_consumers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue(self.options['queue_size'])
+        self._tasks = [t for t in self._tasks if not t.done()]
+        while len(self._tasks) < self.options['concurrency']:
+            self._tasks.append(asyncio.ensure_future(self._consume()))
+
+    def queue(self, stream, context, callback=None, priority=None):
+        # one asyncio queue: `priority` is accepted for compatibility with Client.queue
+        self._ensure_consumers()
+        event = Event(self, stream, context)
+        event.payload = self.transport.encode(context)
+        if self.coalescer is not None and self.coalescer.coalesce(Coalescer.fingerprint(stream, event.payload),
+                                                                  event):
+            metrics.COALESCED.inc()
+            return
+        try:
+            self._queue.put_nowait(event)
+            metrics.ENQUEUED.inc()
+        except asyncio.QueueFull:
+            metrics.DROPPED.inc(reason='newest')
+            logger.debug("async client queue full, dropping event")
+
+    async def _consume(self):
+        while True:
+            event = await self._queue.get()
+            metrics.IN_FLIGHT.inc()
+            try:
+                await self._send_throttled(event)
+                metrics.SENT.inc()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                metrics.FAILED.inc()
+                logger.error("Failed processing job", exc_info=True)
+            finally:
+                metrics.IN_FLIGHT.dec()
+                self._queue.task_done()
+
+    async def _send_throttled(self, event):
+        # on 429 the transport limiter is paused, so the next attempt
+        # waits as long as the server asked
+        for attempt in range(1, self.options['max_attempts'] + 1):
+            try:
+                return await event()
+            except RateLimited:
+                if attempt == self.options['max_attempts']:
+                    raise
+                metrics.RETRIED.inc()
+
+    def empty(self):
+        return self._queue is None or self._queue._unfinished_tasks == 0
+
+    async def flush(self, timeout=None):
+        # returns True if every queued event has been processed
+        if self._queue is None:
+            return True
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self, timeout=None):
+        await self.flush(timeout)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self.transport.close()
+
+    def terminate(self):
+        for task in self._tasks:
+            task.cancel()
+
+
+class AsyncBitcaster(Bitcaster):
+    """
+    asyncio counterpart of Bitcaster, with the same methods.
+
+    `_invoke` is a coroutine, so every method that just returns
+    `self._get(...)`/`self._post(...)` is inherited as is and returns an
+    awaitable. Methods inspecting the response are overridden below: keep
+    them in sync when adding such methods to Bitcaster.
+    """
+
+    def __init__(self, sdt, user_agent='Bitcaster-API', concurrency=32, **kwargs):
+        super().__init__(sdt, user_agent, **kwargs)
+        self.aiohttp = _aiohttp()
+        self.concurrency = concurrency
+        self.session = None
+        self._init_lock = None
+
+    def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = self.aiohttp.TCPConnector(limit=self.concurrency)
+            self.session = self.aiohttp.ClientSession(headers=self.headers, connector=connector)
+        return self.session
+
+    def _after_fork_in_child(self):
+        # the aiohttp session and the asyncio lock belong to the parent's loop
+        self.session = None
+        self._init_lock = None
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def init(self):
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self.conn:
+                return
+            data = self.load_discovery()
+            if data is not None:
+                self.configure(data)
+                return
+            url = self.ping_url
+            timeout = _client_timeout(self.aiohttp, self.get_timeout())
+            try:
+                async with self._get_session().get(url, timeout=timeout) as res:
+                    if res.status != 200:
+                        raise Exception(f'Error {res.status} connecting API: {url}')
+                    data = await res.json(content_type=None)
+                self.configure(data)
+            except asyncio.TimeoutError as e:
+                raise RequestTimeout(f'Timeout connecting API: {url}') from e
+            except Exception as e:
+                logger.exception(e)
+                raise ConnectionError(e)
+            self.save_discovery({k: data[k] for k in ('base_api', 'slug', 'org')})
+
+    async def _invoke(self, method, path, arguments=None):
+        if not self.conn:
+            await self.init()
+        full_url = self.get_url(path)
+        entry, headers = None, None
+        if self.cache is not None and method.lower() == 'get':
+            entry = self.cache.get(full_url)
+            if entry is not None and entry.fresh:
+                return entry.response
+            headers = self.cache.request_headers(entry)
+        data = None
+        if arguments is not None:
+            payload = encode(arguments, self.serializer)
+            data, headers = payload.body, payload.headers
+        timeout = _client_timeout(self.aiohttp, self.get_timeout())
+        start, status, content = time(), None, b''
+        try:
+            async with self._get_session().request(method.upper(), full_url, data=data,
+                                                   headers=headers, timeout=timeout) as res:
+                status = res.status
+                content = await res.read()
+                response = AsyncResponse(res.status, str(res.url), content, dict(res.headers))
+            if self.cache is not None:
+                return self.cache.process(method, full_url, response, entry)
+            return response
+        except asyncio.TimeoutError as e:
+            raise RequestTimeout(f'Timeout contacting remote server: {full_url}') from e
+        except Exception as e:
+            logger.exception(e)
+            raise Exception(f'Unable to contact remote server: {full_url}')
+        finally:
+            self.calls.record(method, full_url, status, time() - start, len(content))
+
+    def _patch(self, path, arguments):
+        return self._invoke('patch', path, arguments)
+
+    def _delete(self, path):
+        return self._invoke('delete', path)
+
+    async def gather(self, *aws, concurrency=None, return_exceptions=False):
+        # like asyncio.gather, but at most `concurrency` awaitables run at once
+        semaphore = asyncio.Semaphore(concurrency or self.concurrency)
+
+        async def bounded(aw):
+            async with semaphore:
+                return await aw
+
+        return await asyncio.gather(*(bounded(aw) for aw in aws),
+                                    return_exceptions=return_exceptions)
+
+    async def map(self, func, iterable, concurrency=None, return_exceptions=False):
+        # es. `await sdk.map(sdk.get_assignments, member_ids)`
+        return await self.gather(*(func(item) for item in iterable),
+                                 concurrency=concurrency,
+                                 return_exceptions=return_exceptions)
+
+    async def _get_page(self, url):
+        res = await self._get(url)
+        if res.status_code != 200:
+            raise RemoteAPIException(res)
+        data = res.json()
+        if isinstance(data, dict) and 'results' in data:
+            return data['results'], data.get('next')
+        return data, None
+
+    async def paginate(self, path, page_size=None, prefetch=True):
+        # async generator: `async for member in sdk.iter_members(): ...`
+        if page_size:
+            path += ('&' if '?' in path else '?') + urlencode({'page_size': page_size})
+        items, url = await self._get_page(path)
+        while True:
+            task = asyncio.ensure_future(self._get_page(url)) if url and prefetch else None
+            try:
+                for item in items:
+                    yield item
+            except BaseException:
+                # consumer stopped early
+                if task is not None:
+                    task.cancel()
+                raise
+            if not url:
+                break
+            items, url = await (task or self._get_page(url))
+
+    async def get_channels(self, **filters):
+        ret = await self._get(f'c/?{urlencode(filters)}')
+        return ret.json()
+
+    async def get_assignments(self, member_id, **filters):
+        res = await self._get(f'm/{member_id}/aa/?{urlencode(filters)}')
+        return res.json()
+
+    async def validate_remote_address(self, otp):
+        if not self.conn:
+            await self.init()
+        url = f'{self.host}/validate/?r=json&k={otp}'
+        return await self._get(url)
+
+    async def add_address(self, member_id, **data):
+        if not member_id:
+            raise ValueError(f'Invalid value "{member_id}" for member_id')
+        return await self._post(f'm/{member_id}/a/', data)
+
+    def import_members(self, rows, **options):
+        # the Importer threads call the sdk methods synchronously
+        raise NotImplementedError('import_members is not available on AsyncBitcaster, use Bitcaster')
+
+    async def get_application(self, app_id):
+        ret = await self._get(f'a/{app_id}/')
+        if ret.status_code == 404:
+            raise Http404(ret)
+        return ret
+
+    async def delete_stream(self, app_id, pk):
+        ret = await self._delete(f'a/{app_id}/s/{pk}/')
+        if ret.status_code == 404:
+            raise Http404(ret)
+        if ret.status_code != 204:
+            raise RemoteAPIException(ret)
+        return ret
+
+    async def filter_streams(self, app_id, **filters):
+        ret = await self._get(f'a/{app_id}/s/?{urlencode(filters)}')
+        return ret.json()
+
+    def stream_resolver(self, app_id, **kwargs):
+        # StreamResolver fetches from a thread, synchronously
+        raise NotImplementedError('stream_resolver is not available on AsyncBitcaster, use Bitcaster')
+
+    async def create_stream(self, app_id, **data):
+        res = await self._post(f'a/{app_id}/s/', data)
+        if res.status_code not in [201, 409]:
+            raise RemoteAPIException(res)
+        return res
+
+    async def update_stream(self, app_id, stream_id, **data):
+        res = await self._patch(f'a/{app_id}/s/{stream_id}/', data)
+        if res.status_code == 404:
+            raise Http404(res)
+        if res.status_code != 200:
+            raise RemoteAPIException(res)
+        return res
+
+
+def init(*args, **kwargs):
+    global client
+    bae = os.environ.get('BITCASTER_AEP')
+    client = AsyncClient(bae, *args, **kwargs)
+    return client
+
+
+def trigger(stream: int, arguments: dict = None):
+    client.queue(stream, arguments)
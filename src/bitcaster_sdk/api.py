@@ -1,6 +1,10 @@
+from typing import Union
+
 from . import client
 
 
-def trigger(stream: int, arguments: dict = None):
-    client.client.queue(stream, arguments)
+def trigger(stream: Union[int, str], arguments: dict = None, priority: str = None):
+    # `stream` is the id, the slug or the name of the stream
+    # `priority` is the worker lane, see BackgroundWorker `lanes`
+    client.client.queue(stream, arguments, priority=priority)
 
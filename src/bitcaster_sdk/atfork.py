@@ -0,0 +1,45 @@
+"""
+fork handling for pre-fork servers (gunicorn, uwsgi, celery...).
+
+Objects holding threads, locks or sockets register here and get
+`_before_fork()`, `_after_fork_in_parent()` and `_after_fork_in_child()`
+called around `os.fork()`, if they define them.
+"""
+import os
+import weakref
+
+from .logging import logger
+
+_registry = weakref.WeakSet()  # type: weakref.WeakSet
+
+
+def register(obj):
+    _registry.add(obj)
+    return obj
+
+
+def _run(hook):
+    for obj in list(_registry):
+        method = getattr(obj, hook, None)
+        if method is None:
+            continue
+        try:
+            method()
+        except Exception:
+            logger.error(f'Error in {obj.__class__.__name__}.{hook}', exc_info=True)
+
+
+def _before():
+    _run('_before_fork')
+
+
+def _after_in_parent():
+    _run('_after_fork_in_parent')
+
+
+def _after_in_child():
+    _run('_after_fork_in_child')
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(before=_before, after_in_parent=_after_in_parent, after_in_child=_after_in_child)
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Optional
+from urllib.parse import urlparse
+
+from . import atfork
+from .calllog import url_template
+
+
+class Entry:
+    __slots__ = ('response', 'etag', 'expires')
+
+    def __init__(self, response, etag, expires):
+        self.response = response
+        self.etag = etag
+        self.expires = expires
+
+    @property
+    def fresh(self):
+        return monotonic() < self.expires
+
+
+class ResponseCache:
+    """
+    read-through cache of the Bitcaster admin API GET responses.
+
+    Entries live `ttl` seconds; `ttls` overrides it per endpoint, keyed by
+    the url template relative to the organization, ie. {'c/': 600,
+    'a/{id}/s/': 30}. A `None` ttl disables caching for the endpoint.
+    Expired entries with an ETag are revalidated with `If-None-Match`.
+    At most `maxsize` responses are kept, least recently used are evicted.
+    Any successful non GET request invalidates the resource, its
+    collection and its parents.
+    GETs with side effects (`uncached`, ie. OTP validation) are never cached.
+    """
+
+    uncached = ('validate/',)
+
+    def __init__(self, maxsize=256, ttl=60, ttls=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        atfork.register(self)
+
+    def _after_fork_in_child(self):
+        # inherited locked if a parent thread was using the cache
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl_for(self, url):
+        # type: (str) -> Optional[float]
+        template = url_template(url)
+        if any(template.endswith('/' + suffix) for suffix in self.uncached):
+            return None
+        for suffix, ttl in self.ttls.items():
+            if template.endswith('/' + suffix.lstrip('/')):
+                return ttl
+        return self.ttl
+
+    def get(self, url):
+        # type: (str) -> Optional[Entry]
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(url)
+            if entry.fresh:
+                self.hits += 1
+            return entry
+
+    def request_headers(self, entry):
+        # type: (Optional[Entry]) -> dict
+        if entry is not None and entry.etag:
+            return {'If-None-Match': entry.etag}
+        return {}
+
+    def process(self, method, url, response, entry=None):
+        # type: (str, str, Any, Optional[Entry]) -> Any
+        # returns the response to hand to the caller
+        if method.lower() != 'get':
+            if response.status_code < 400:
+                self.invalidate(url)
+            return response
+        ttl = self.ttl_for(url)
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.revalidated += 1
+                entry.expires = monotonic() + (ttl or 0)
+            return entry.response
+        etag = response.headers.get('ETag')
+        if response.status_code == 200 and ttl is not None and (ttl > 0 or etag):
+            self._store(url, Entry(response, etag, monotonic() + ttl))
+        return response
+
+    def _store(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url):
+        # type: (str) -> None
+        path = urlparse(url).path
+        collection = path.rstrip('/').rsplit('/', 1)[0] + '/'
+        with self._lock:
+            for key in list(self._entries):
+                cached = urlparse(key).path
+                if cached.startswith(collection) or path.startswith(cached):
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,79 @@
+import random
+import re
+import threading
+from collections import deque, namedtuple
+from time import time
+from typing import Optional
+from urllib.parse import urlparse
+
+from . import atfork
+
+CallRecord = namedtuple('CallRecord', 'timestamp method template status duration bytes')
+
+_ID = re.compile(r'^(\d+|[0-9a-f]{8}-[0-9a-f-]{27})$')
+
+
+def url_template(url):
+    # type: (str) -> str
+    # '/api/o/bitcaster/m/12/aa/?page=2' -> '/api/o/bitcaster/m/{id}/aa/'
+    path = urlparse(url).path
+    return '/'.join('{id}' if _ID.match(part) else part for part in path.split('/'))
+
+
+class CallLog:
+    """
+    fixed size ring buffer of sampled API calls.
+
+    Only a `sample_rate` fraction of the calls is recorded and only the
+    last `size` records are kept.
+    """
+
+    def __init__(self, size=1000, sample_rate=1.0):
+        self.sample_rate = sample_rate
+        self.total = 0
+        self._records = deque(maxlen=size)
+        self._lock = threading.Lock()
+        atfork.register(self)
+
+    def _after_fork_in_child(self):
+        self._lock = threading.Lock()
+
+    def record(self, method, url, status, duration, size):
+        # type: (str, str, Optional[int], float, int) -> None
+        if self.sample_rate < 1 and random.random() >= self.sample_rate:
+            with self._lock:
+                self.total += 1
+            return
+        entry = CallRecord(time(), method.upper(), url_template(url), status, duration, size)
+        with self._lock:
+            self.total += 1
+            self._records.append(entry)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._records))
+
+    def __len__(self):
+        return len(self._records)
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
+
+    def stats(self):
+        # type: () -> dict
+        # per endpoint aggregates of the recorded calls
+        ret = {}
+        for entry in self:
+            key = f'{entry.method} {entry.template}'
+            s = ret.setdefault(key, {'count': 0, 'errors': 0, 'total_time': 0.0,
+                                     'max_time': 0.0, 'bytes': 0})
+            s['count'] += 1
+            if entry.status is None or entry.status >= 400:
+                s['errors'] += 1
+            s['total_time'] += entry.duration
+            s['max_time'] = max(s['max_time'], entry.duration)
+            s['bytes'] += entry.bytes
+        for s in ret.values():
+            s['avg_time'] = s['total_time'] / s['count']
+        return ret
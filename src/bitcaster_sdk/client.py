@@ -1,15 +1,36 @@
+import base64
+import hashlib
+import json
 import re
-from typing import Any
+import threading
+import uuid
+from collections import OrderedDict
+from time import monotonic, time
+from typing import Any, Optional
+from urllib.parse import urlparse
 
 from bitcaster_sdk.exceptions import (AuthenticationError, ConfigurationError,
-                                      StreamNotFound)
+                                      RateLimited, ServerError, StreamNotFound)
 
+from . import atfork, metrics
 from .logging import logger
+from .ratelimit import retry_after
+from .serializers import Payload
+from .streams import StreamResolver
 from .transport import Transport
 
 client = None
 
 
+def next_page(data):
+    # type: (Any) -> Optional[str]
+    # path of the next page of a paginated response, for Transport.get()
+    if not isinstance(data, dict) or not data.get('next'):
+        return None
+    parts = urlparse(data['next'])
+    return f'{parts.path}?{parts.query}' if parts.query else parts.path
+
+
 class AbstractClient:
     url_regex = ''
 
@@ -24,6 +45,119 @@ class AbstractClient:
             raise ConfigurationError(f'Unable to parse Bitcaster url: "{url}"" {e}')
 
 
+class Event:
+    # queued trigger. Callable so that any worker can just run it, but keeps
+    # stream/context around for batch dispatchers and result reporting
+    def __init__(self, client, stream, context, deadline=None, key=None):
+        self.client = client
+        self.stream = stream
+        self.context = context
+        # absolute time after which the event is not worth sending anymore
+        self.deadline = deadline
+        # sent as Idempotency-Key, the same for every retry
+        self.key = key or uuid.uuid4().hex
+        # identical events coalesced into this one, until it is dispatched
+        self.count = 1
+        self.dispatched = False
+        # worker priority lane, see BackgroundWorker `lanes`
+        self.lane = None
+        self.spool_id = None
+        # serialized body, when built at enqueue time
+        self.payload = None
+        self._size = None
+
+    def headers(self):
+        # type: () -> dict
+        ret = {'Idempotency-Key': self.key}
+        if self.count > 1:
+            ret['X-Coalesced-Count'] = str(self.count)
+        return ret
+
+    def __call__(self):
+        coalescer = getattr(self.client, 'coalescer', None)
+        if coalescer is not None:
+            coalescer.dispatch(self)
+        else:
+            self.dispatched = True
+        body = self.context if self.payload is None else self.payload
+        return self.client.send(self.stream, body, deadline=self.deadline, headers=self.headers())
+
+    @property
+    def size(self):
+        # approximate payload size, used by the worker `queue_bytes` limit
+        if self._size is None:
+            if self.payload is not None:
+                self._size = len(self.payload)
+            else:
+                self._size = len(json.dumps(self.context, default=str))
+        return self._size
+
+    def serialize(self):
+        # spool record. The encoded body is kept when available: relayed
+        # events have no context, and it is what the worker would send
+        ret = {'stream': self.stream, 'key': self.key, 'lane': self.lane}
+        if self.payload is None:
+            ret['context'] = self.context
+        else:
+            ret['body'] = base64.b64encode(self.payload.body).decode('ascii')
+            ret['headers'] = self.payload.headers
+        return ret
+
+    def __repr__(self):
+        return f'<Event stream={self.stream}>'
+
+
+class Coalescer:
+    """
+    collapses identical events queued within `window` seconds.
+
+    The first event is kept and queued, the following ones only increase
+    its `count` until it is dispatched: after that (sent, failed or being
+    retried) the next identical event is queued and starts a new group.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._events = OrderedDict()  # fingerprint -> (expires, event)
+        self._lock = threading.Lock()
+        atfork.register(self)
+
+    def _after_fork_in_child(self):
+        # the lock may have been held by a thread of the parent
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(stream, payload):
+        # type: (object, Any) -> tuple
+        return stream, hashlib.sha1(payload.body).hexdigest()
+
+    def coalesce(self, key, event):
+        # type: (tuple, Any) -> Any
+        # returns the pending event `event` was merged into, or None
+        now = monotonic()
+        with self._lock:
+            while self._events:
+                first = next(iter(self._events.values()))
+                if first[0] > now:
+                    break
+                self._events.popitem(last=False)
+            entry = self._events.get(key)
+            if entry is not None and not entry[1].dispatched:
+                entry[1].count += 1
+                return entry[1]
+            self._events.pop(key, None)
+            self._events[key] = (now + self.window, event)
+        return None
+
+    def dispatch(self, event):
+        # from now on `event.count` is final
+        with self._lock:
+            event.dispatched = True
+
+    def __len__(self):
+        return len(self._events)
+
+
 class Client(AbstractClient):
     url_regex = r"(?P<schema>https?):\/\/(?P<token>.*)@" \
                 r"(?P<host>.*)\/api\/o\/(?P<organization>.*)\/" \
@@ -34,8 +168,21 @@ class Client(AbstractClient):
         # bae -> Bitcaster Application Endpoint
         self.bae = bae
         self.options = {'debug': debug, 'shutdown_timeout': 10}
+        self.options.update(kwargs)
         self.parse_url(bae)
+        if self.options.get('metrics'):
+            metrics.enable()
         self.transport = Transport(**self.options)
+        self.transport.thread.loader = self.load_event
+        # stream slug/name -> id; `stream_refresh` warms it up and keeps it fresh in background
+        self.streams = self.options.get('streams') or StreamResolver(
+            self.fetch_streams, refresh_interval=self.options.get('stream_refresh') or 300)
+        if self.options.get('stream_refresh'):
+            self.streams.start()
+        # coalesce_window: seconds in which identical (stream, context) events are sent once
+        self.coalescer = Coalescer(self.options['coalesce_window']) if self.options.get('coalesce_window') else None
+        if self.transport.thread.spool is not None:
+            self.replay()
 
     @property
     def debug(self):
@@ -52,6 +199,12 @@ class Client(AbstractClient):
         if response.status_code in [404]:
             raise StreamNotFound("Invalid Stream ")
 
+        if response.status_code == 429:
+            raise RateLimited({'time_left': retry_after(response)})
+
+        if response.status_code >= 500:
+            raise ServerError(response.status_code, response.url)
+
         if response.status_code not in [201, 200]:
             raise ConnectionError(response.status_code, response.url)
 
@@ -62,18 +215,68 @@ class Client(AbstractClient):
     def empty(self):
         return self.transport.thread.empty()
 
-    def queue(self, stream, context, callback=None):
-        def send():
-            self.send(stream, context)
+    def fetch_streams(self):
+        # every page: slugs and names of the later pages must resolve too
+        streams, path = [], 's/'
+        while path:
+            response = self.transport.get(path)
+            self.assert_response(response)
+            data = response.json()
+            streams.extend(data['results'] if isinstance(data, dict) else data)
+            path = next_page(data)
+        return streams
+
+    def queue(self, stream, context, callback=None, priority=None):
+        # `deadline` option: seconds to deliver the event, retries included
+        # `priority`: worker lane for this event, overrides the stream one
+        deadline = time() + self.options['deadline'] if self.options.get('deadline') else None
+        event = Event(self, stream, context, deadline)
+        event.lane = priority
+        # serialized now: later changes to `context` do not affect the event
+        event.payload = self.transport.encode(context)
+        if self.coalescer is not None and self.coalescer.coalesce(Coalescer.fingerprint(stream, event.payload),
+                                                                  event):
+            metrics.COALESCED.inc()
+            return
+        self.transport.submit(event)
 
-        self.transport.submit(send)
+    def load_event(self, record):
+        event = Event(self, record['stream'], record.get('context'), key=record.get('key'))
+        if 'body' in record:
+            event.payload = Payload(base64.b64decode(record['body']), record.get('headers') or {})
+        event.spool_id = record['id']
+        event.lane = record.get('lane')
+        return event
 
-    def send(self, stream, context):
+    def replay(self):
+        # resubmit events left in the spool by a previous process
+        worker = self.transport.thread
+        for record in worker.spool.pending():
+            worker.resume(self.load_event(record))
+
+    def send(self, stream, context, timeout=None, deadline=None, headers=None):
+        stream = self.streams.resolve(stream)
+        headers = dict(headers or {})
+        headers.setdefault('Idempotency-Key', uuid.uuid4().hex)
         if self.debug:
             logger.debug(f'sending to {stream}')
-        response = self.transport.post(f's/{stream}/trigger/', context)
+        start, status = time(), 'error'
+        try:
+            response = self.transport.post(f's/{stream}/trigger/', context, stream=stream,
+                                           timeout=timeout, deadline=deadline, headers=headers)
+            status = response.status_code
+        finally:
+            metrics.SEND_SECONDS.observe(time() - start, stream=stream, status=status)
         self.assert_response(response)
         return response
 
-    def terminate(self):
-        self.transport.thread.terminate()
+    def flush(self, timeout=None):
+        # type: (Optional[float]) -> dict
+        # sends what is queued, waiting at most `timeout` seconds. See BackgroundWorker.flush
+        return self.transport.thread.flush(timeout)
+
+    def terminate(self, timeout=None):
+        # type: (Optional[float]) -> dict
+        # flushes, then stops the worker. See BackgroundWorker.shutdown
+        self.streams.stop()
+        return self.transport.thread.shutdown(timeout)
@@ -1,6 +1,5 @@
 from json import JSONDecodeError
 
-import humanfriendly
 import requests
 
 
@@ -16,11 +15,29 @@ class AuthenticationError(Exception):
     pass
 
 
+class ServerError(ConnectionError):
+    # 5xx response to a trigger: retried by background workers
+    pass
+
+
+class RequestTimeout(requests.exceptions.Timeout):
+    pass
+
+
+class DeadlineExceeded(RequestTimeout):
+    pass
+
+
 class RateLimited(Exception):
     def __init__(self, data):
         self.data = data
 
+    @property
+    def time_left(self):
+        return self.data['time_left']
+
     def __str__(self):
+        import humanfriendly
         return 'Too many requests. Please retry in %s' % humanfriendly.format_timespan(self.data['time_left'],
                                                                                        max_units=1)
 
@@ -0,0 +1,185 @@
+"""
+bulk import of members, addresses and assignments.
+
+Each input row is a flat mapping:
+
+    email,name,role,label,address,channel,verify
+    a@example.com,user1,member,work,a@example.com,systememail,1
+
+`address`, `label`, `channel` and `verify` are optional, every other
+column is sent to `add_member`. For each row the member is created, then
+its address, the assignment to `channel` and, if `verify` is set, the
+assignment is verified.
+
+    bitcaster-import members.csv --report report.csv --checkpoint import.ckpt
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Callable, Iterable, Iterator, Optional
+
+from .exceptions import RemoteAPIException
+
+ADDRESS_FIELDS = ('label', 'address', 'channel', 'verify')
+
+RowResult = namedtuple('RowResult', 'row status member address assignment error')
+
+REPORT_FIELDS = RowResult._fields
+
+
+def _truthy(value):
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def read_csv(stream):
+    # type: (Iterable[str]) -> Iterator[dict]
+    for row in csv.DictReader(stream):
+        yield {k: v for k, v in row.items() if v not in (None, '')}
+
+
+def read_ndjson(stream):
+    # type: (Iterable[str]) -> Iterator[dict]
+    for line in stream:
+        if line.strip():
+            yield json.loads(line)
+
+
+READERS = {'csv': read_csv, 'ndjson': read_ndjson}
+
+
+def _created(response, step):
+    # type: (...) -> int
+    if response.status_code not in (200, 201):
+        raise RemoteAPIException(response, message=f'{step}: {RemoteAPIException.message}')
+    return response.json()['id']
+
+
+class Importer:
+    """
+    runs the rows in chunks of `chunk_size`, at most `concurrency` at once.
+
+    After every chunk the number of processed rows is saved to
+    `checkpoint`, a run with the same checkpoint skips them. Results are
+    appended to the `report` CSV file; `progress(done, failed)` is called
+    after every chunk.
+    """
+
+    def __init__(self, sdk, concurrency=8, chunk_size=500, checkpoint=None, report=None,
+                 progress=None):
+        # type: (...) -> None
+        self.sdk = sdk
+        self.concurrency = concurrency
+        self.chunk_size = chunk_size
+        self.checkpoint = checkpoint  # type: Optional[str]
+        self.report = report  # type: Optional[str]
+        self.progress = progress  # type: Optional[Callable[[int, int], None]]
+
+    def import_row(self, index, row):
+        # type: (int, dict) -> RowResult
+        member = {k: v for k, v in row.items() if k not in ADDRESS_FIELDS}
+        member_id = address_id = assignment_id = None
+        try:
+            member_id = _created(self.sdk.add_member(**member), 'add_member')
+            if row.get('address'):
+                address_id = _created(self.sdk.add_address(member_id, label=row.get('label', row['address']),
+                                                           address=row['address']), 'add_address')
+                if row.get('channel'):
+                    assignment_id = _created(self.sdk.create_assignment(member_id, address=address_id,
+                                                                        channel=row['channel']),
+                                             'create_assignment')
+                    if _truthy(row.get('verify', '')):
+                        res = self.sdk.verify_assignment(member_id, assignment_id)
+                        if res.status_code >= 400:
+                            raise RemoteAPIException(res)
+        except Exception as e:
+            return RowResult(index, 'failed', member_id, address_id, assignment_id, str(e))
+        return RowResult(index, 'ok', member_id, address_id, assignment_id, '')
+
+    def load_checkpoint(self):
+        # type: () -> int
+        if self.checkpoint and os.path.exists(self.checkpoint):
+            with open(self.checkpoint) as f:
+                return json.load(f)['rows']
+        return 0
+
+    def save_checkpoint(self, rows):
+        if self.checkpoint:
+            tmp = f'{self.checkpoint}.tmp'
+            with open(tmp, 'w') as f:
+                json.dump({'rows': rows}, f)
+            os.replace(tmp, self.checkpoint)
+
+    def write_report(self, results):
+        if not self.report:
+            return
+        new = not os.path.exists(self.report)
+        with open(self.report, 'a', newline='') as f:
+            writer = csv.writer(f)
+            if new:
+                writer.writerow(REPORT_FIELDS)
+            writer.writerows(results)
+
+    def run(self, rows):
+        # type: (Iterable[dict]) -> dict
+        done = skipped = self.load_checkpoint()
+        failed = 0
+        rows = enumerate(rows)
+        for _ in islice(rows, skipped):
+            pass
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='bitcaster_sdk.import') as executor:
+            while True:
+                chunk = list(islice(rows, self.chunk_size))
+                if not chunk:
+                    break
+                results = list(executor.map(lambda args: self.import_row(*args), chunk))
+                self.write_report(results)
+                done += len(results)
+                failed += sum(1 for r in results if r.status != 'ok')
+                self.save_checkpoint(done)
+                if self.progress:
+                    self.progress(done, failed)
+        return {'rows': done, 'skipped': skipped, 'imported': done - skipped - failed, 'failed': failed}
+
+
+def main(argv=None):
+    from .sdk import Bitcaster
+
+    parser = argparse.ArgumentParser(prog='bitcaster-import',
+                                     description='Import members, addresses and assignments in Bitcaster')
+    parser.add_argument('input', help='CSV or NDJSON file, `-` for stdin')
+    parser.add_argument('--format', choices=sorted(READERS), help='input format (default: from extension)')
+    parser.add_argument('--sdt', default=os.environ.get('BITCASTER_SDT'),
+                        help='Bitcaster SDK token url (default: $BITCASTER_SDT)')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--chunk-size', type=int, default=500)
+    parser.add_argument('--checkpoint', help='resume file')
+    parser.add_argument('--report', help='per row CSV report')
+    args = parser.parse_args(argv)
+    if not args.sdt:
+        parser.error('--sdt or BITCASTER_SDT is required')
+    fmt = args.format or ('ndjson' if args.input.endswith(('.ndjson', '.jsonl')) else 'csv')
+
+    def progress(done, failed):
+        sys.stderr.write(f'\r{done} rows, {failed} failed')
+        sys.stderr.flush()
+
+    importer = Importer(Bitcaster(args.sdt), concurrency=args.concurrency, chunk_size=args.chunk_size,
+                        checkpoint=args.checkpoint, report=args.report, progress=progress)
+    stream = sys.stdin if args.input == '-' else open(args.input, newline='')
+    try:
+        summary = importer.run(READERS[fmt](stream))
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    sys.stderr.write('\n')
+    print(json.dumps(summary))
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
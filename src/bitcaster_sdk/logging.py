@@ -2,7 +2,16 @@ import logging
 import sys
 
 logger = logging.getLogger('bitcaster_sdk')
+# no output unless the application configures logging, see `console()`
+logger.addHandler(logging.NullHandler())
 
-h = logging.StreamHandler(sys.stdout)
-h.flush = sys.stdout.flush
-logger.addHandler(h)
+
+def console(level=None):
+    # type: (int) -> logging.Handler
+    # log to stdout, as the SDK did by default
+    h = logging.StreamHandler(sys.stdout)
+    h.flush = sys.stdout.flush
+    logger.addHandler(h)
+    if level is not None:
+        logger.setLevel(level)
+    return h
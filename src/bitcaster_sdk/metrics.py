@@ -0,0 +1,241 @@
+import threading
+import weakref
+from bisect import bisect_left
+
+from . import atfork
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+class Metric:
+    kind = ''
+
+    def __init__(self, registry, name, doc, labels=()):
+        self.registry = registry
+        self.name = name
+        self.doc = doc
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        atfork.register(self)
+
+    def _after_fork_in_child(self):
+        # a parent thread may have been updating the metric at fork time
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        # type: (dict) -> tuple
+        return tuple(str(labels.get(label, '')) for label in self.labels)
+
+    def _label_str(self, key, extra=None):
+        pairs = list(zip(self.labels, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{%s}' % ','.join(f'{k}="{_escape(v)}"' for k, v in pairs)
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+    def snapshot(self):
+        values = self.samples()
+        if not self.labels:
+            return values.get((), 0)
+        return {','.join(f'{k}={v}' for k, v in zip(self.labels, key)): value
+                for key, value in values.items()}
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.samples().items()):
+            lines.append(f'{self.name}{self._label_str(key)} {value}')
+        return lines
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._functions = {}  # labels key -> func, or weakref to a bound method
+
+    def set_function(self, func, **labels):
+        # value is read from `func()` at collection time. Bound methods are
+        # weakly referenced: the sample goes away with their object
+        if hasattr(func, '__self__'):
+            func = weakref.WeakMethod(func)
+        with self._lock:
+            self._functions[self._key(labels)] = func
+
+    def set(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            if not self._functions:
+                return dict(self._values)
+            functions = list(self._functions.items())
+        ret = {}
+        for key, func in functions:
+            if isinstance(func, weakref.WeakMethod):
+                ref, func = func, func()
+                if func is None:
+                    with self._lock:
+                        if self._functions.get(key) is ref:
+                            del self._functions[key]
+                    continue
+            ret[key] = func()
+        return ret
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(registry, name, doc, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        if not self.registry.enabled:
+            return
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # per bucket counts, the last one is +Inf
+                entry = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0, 'count': 0}
+            entry['counts'][bisect_left(self.buckets, value)] += 1
+            entry['sum'] += value
+            entry['count'] += 1
+
+    def _cumulative(self, entry):
+        ret, total = {}, 0
+        for bound, count in zip(self.buckets + ('+Inf',), entry['counts']):
+            total += count
+            ret[str(bound)] = total
+        return ret
+
+    def samples(self):
+        with self._lock:
+            return {key: {'count': entry['count'], 'sum': entry['sum'], 'buckets': self._cumulative(entry)}
+                    for key, entry in self._values.items()}
+
+    def snapshot(self):
+        values = self.samples()
+        if not self.labels:
+            return values.get((), {'count': 0, 'sum': 0.0, 'buckets': {}})
+        return super().snapshot()
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.doc}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.samples().items()):
+            for bound, count in value['buckets'].items():
+                lines.append(f'{self.name}_bucket{self._label_str(key, ("le", bound))} {count}')
+            lines.append(f'{self.name}_sum{self._label_str(key)} {value["sum"]}')
+            lines.append(f'{self.name}_count{self._label_str(key)} {value["count"]}')
+        return lines
+
+
+class Registry:
+    """
+    in-process metrics. Disabled by default: every update is then a
+    single attribute check.
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+        atfork.register(self)
+
+    def _after_fork_in_child(self):
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(self, name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, doc, labels=()):
+        # type: (str, str, tuple) -> Counter
+        return self._register(Counter, name, doc, labels)
+
+    def gauge(self, name, doc, labels=()):
+        # type: (str, str, tuple) -> Gauge
+        return self._register(Gauge, name, doc, labels)
+
+    def histogram(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        # type: (str, str, tuple, tuple) -> Histogram
+        return self._register(Histogram, name, doc, labels, buckets)
+
+    def snapshot(self):
+        # type: () -> dict
+        return {name: metric.snapshot() for name, metric in sorted(self._metrics.items())}
+
+    def to_prometheus(self):
+        # type: () -> str
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        for metric in self._metrics.values():
+            metric.reset()
+
+
+registry = Registry()
+
+
+def enable():
+    registry.enabled = True
+
+
+def disable():
+    registry.enabled = False
+
+
+ENQUEUED = registry.counter('bitcaster_events_enqueued_total', 'Events accepted by the worker queue.')
+SENT = registry.counter('bitcaster_events_sent_total', 'Events delivered.')
+FAILED = registry.counter('bitcaster_events_failed_total', 'Events given up on.')
+RETRIED = registry.counter('bitcaster_events_retried_total', 'Delivery attempts scheduled for retry.')
+COALESCED = registry.counter('bitcaster_events_coalesced_total', 'Events merged into an identical queued one.')
+DROPPED = registry.counter('bitcaster_events_dropped_total', 'Events dropped on a full queue.', ('reason',))
+QUEUE_DEPTH = registry.gauge('bitcaster_queue_depth', 'Events waiting in the worker queue.', ('worker',))
+IN_FLIGHT = registry.gauge('bitcaster_sends_in_flight', 'Events being sent.')
+SEND_SECONDS = registry.histogram('bitcaster_send_duration_seconds', 'Trigger request latency.',
+                                  ('stream', 'status'))
@@ -0,0 +1,121 @@
+import threading
+from email.utils import parsedate_to_datetime
+from time import monotonic, sleep, time
+from typing import Any, Optional
+
+from .exceptions import RateLimited
+
+DEFAULT_RETRY_AFTER = 1
+
+
+def retry_after(response):
+    # type: (Any) -> float
+    # seconds to wait after a 429, from `Retry-After` (seconds or HTTP date)
+    # or from the `time_left` attribute of the JSON body
+    value = response.headers.get('Retry-After')
+    if value:
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            try:
+                return max(parsedate_to_datetime(value).timestamp() - time(), 0)
+            except (TypeError, ValueError):
+                pass
+    try:
+        return max(float(response.json()['time_left']), 0)
+    except Exception:
+        return DEFAULT_RETRY_AFTER
+
+
+class TokenBucket:
+    def __init__(self, rate=None, burst=None):
+        # rate: tokens per second, None means unlimited
+        self.rate = rate
+        self.capacity = (burst or max(rate, 1)) if rate else None
+        self.tokens = self.capacity
+        self.updated = monotonic()
+        self.paused_until = 0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        # type: () -> float
+        # takes a token and returns 0, or returns the seconds to wait
+        with self._lock:
+            current = monotonic()
+            if current < self.paused_until:
+                return self.paused_until - current
+            if self.rate is None:
+                return 0
+            self.tokens = min(self.capacity, self.tokens + (current - self.updated) * self.rate)
+            self.updated = current
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        with self._lock:
+            if self.rate is not None:
+                self.tokens = min(self.capacity, self.tokens + 1)
+
+    def pause(self, seconds):
+        # type: (float) -> None
+        with self._lock:
+            self.paused_until = max(self.paused_until, monotonic() + seconds)
+            if self.rate is not None:
+                self.tokens = 0
+                self.updated = self.paused_until
+
+
+class RateLimiter:
+    """
+    client side throttling of trigger requests.
+
+    One token bucket for the application (`rate`/`burst`) and one per
+    stream (`stream_rate`/`stream_burst`); a 429 from the server pauses the
+    bucket it applies to for the time the server asked.
+    """
+
+    def __init__(self, rate=None, burst=None, stream_rate=None, stream_burst=None):
+        self.application = TokenBucket(rate, burst)
+        self.stream_rate = stream_rate
+        self.stream_burst = stream_burst
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, stream):
+        # type: (Any) -> TokenBucket
+        with self._lock:
+            if stream not in self._streams:
+                self._streams[stream] = TokenBucket(self.stream_rate, self.stream_burst)
+            return self._streams[stream]
+
+    def reserve(self, stream=None):
+        # type: (Any) -> float
+        bucket = self._bucket(stream) if stream is not None else None
+        if bucket:
+            wait = bucket.reserve()
+            if wait:
+                return wait
+        wait = self.application.reserve()
+        if wait and bucket:
+            bucket.refund()
+        return wait
+
+    def acquire(self, stream=None, block=False, timeout=None):
+        # type: (Any, bool, Optional[float]) -> None
+        deadline = monotonic() + timeout if timeout is not None else None
+        while True:
+            wait = self.reserve(stream)
+            if not wait:
+                return
+            if not block or (deadline is not None and monotonic() + wait > deadline):
+                raise RateLimited({'time_left': wait})
+            sleep(wait)
+
+    def pause(self, seconds, stream=None):
+        # type: (float, Any) -> None
+        if stream is not None:
+            self._bucket(stream).pause(seconds)
+        else:
+            self.application.pause(seconds)
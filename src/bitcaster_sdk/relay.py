@@ -0,0 +1,253 @@
+"""
+host wide relay.
+
+Processes hand their events to a single relay over a Unix socket, the
+relay queues them in one BatchWorker and sends them with one connection
+pool:
+
+    bitcaster-relay --socket /run/bitcaster.sock
+
+    bitcaster_sdk.init(worker=RelayWorker('/run/bitcaster.sock'))
+
+Each event is a frame: a `!BHI` prefix (version, header length, body
+length), a JSON header with stream, key, lane, count, deadline and
+request headers, and the already serialized body.
+"""
+import argparse
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import threading
+from typing import Optional
+
+from . import metrics
+from .exceptions import ConfigurationError
+from .logging import logger
+from .worker import AbstractWorker
+
+VERSION = 1
+PREFIX = struct.Struct('!BHI')
+
+
+def encode_frame(header, body):
+    # type: (dict, bytes) -> bytes
+    data = json.dumps(header, separators=(',', ':')).encode()
+    return PREFIX.pack(VERSION, len(data), len(body)) + data + body
+
+
+def read_frame(stream):
+    # type: (...) -> Optional[tuple]
+    # returns (header, body), None at end of stream
+    prefix = stream.read(PREFIX.size)
+    if len(prefix) < PREFIX.size:
+        return None
+    version, header_size, body_size = PREFIX.unpack(prefix)
+    if version != VERSION:
+        raise ValueError(f'Unsupported frame version {version}')
+    data = stream.read(header_size)
+    body = stream.read(body_size)
+    if len(data) < header_size or len(body) < body_size:
+        # the sender died (or the connection dropped) in the middle of the frame
+        raise ValueError('Truncated frame')
+    return json.loads(data), body
+
+
+class RelayWorker(AbstractWorker):
+    """
+    client side: writes events to the relay socket.
+
+    Events are not acknowledged by the relay; if it cannot be reached the
+    event goes to `fallback` (any worker) or is dropped.
+    """
+
+    def __init__(self, path, timeout=1, fallback=None):
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self.fallback = fallback  # type: Optional[AbstractWorker]
+        self.dropped = 0
+        self._socket = None
+        self._socket_pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # type: () -> socket.socket
+        # one connection per process: a forked child opens its own
+        if self._socket is None or self._socket_pid != os.getpid():
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            self._socket, self._socket_pid = sock, os.getpid()
+        return self._socket
+
+    def _close(self):
+        if self._socket is not None and self._socket_pid == os.getpid():
+            self._socket.close()
+        self._socket = None
+
+    @staticmethod
+    def frame(event):
+        # type: (...) -> bytes
+        payload = event.payload
+        if payload is None:
+            payload = event.client.transport.encode(event.context)
+        header = {'stream': event.stream, 'key': event.key, 'headers': payload.headers}
+        if event.lane:
+            header['lane'] = event.lane
+        if event.count > 1:
+            header['count'] = event.count
+        if event.deadline:
+            header['deadline'] = event.deadline
+        return encode_frame(header, payload.body)
+
+    def submit(self, callback):
+        data = self.frame(callback)
+        with self._lock:
+            for __ in range(2):  # reconnect once, the relay may have been restarted
+                try:
+                    self._connect().sendall(data)
+                    metrics.ENQUEUED.inc()
+                    return
+                except OSError as e:
+                    self._close()
+                    error = e
+        if self.fallback is not None:
+            self.fallback.submit(callback)
+            return
+        self.dropped += 1
+        metrics.DROPPED.inc(reason='relay')
+        logger.warning(f'relay {self.path} unavailable, dropping event: {error}')
+
+    def empty(self):
+        return True
+
+    def terminate(self):
+        with self._lock:
+            self._close()
+
+
+class RelayHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            try:
+                frame = read_frame(self.rfile)
+            except (ValueError, OSError) as e:
+                logger.error(f'relay: invalid frame, closing connection: {e}')
+                return
+            if frame is None:
+                return
+            self.server.dispatch(*frame)
+
+
+class RelayServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    relay side: queues the received events on `client`, so they share its
+    worker and connection pool.
+    """
+    daemon_threads = True
+
+    def __init__(self, path, client):
+        self.remove_stale(path)
+        self.client = client
+        self.received = 0
+        super().__init__(path, RelayHandler)
+
+    @staticmethod
+    def remove_stale(path):
+        # type: (str) -> None
+        # only the socket of a previous run: never a regular file (a typo in
+        # --socket) nor the socket of a relay still running
+        try:
+            mode = os.lstat(path).st_mode
+        except FileNotFoundError:
+            return
+        if not stat.S_ISSOCK(mode):
+            raise ConfigurationError(f'{path} exists and is not a socket')
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(path)
+        except OSError:
+            os.unlink(path)
+            return
+        finally:
+            probe.close()
+        raise ConfigurationError(f'a relay is already listening on {path}')
+
+    def dispatch(self, header, body):
+        # type: (dict, bytes) -> None
+        from .client import Event
+        from .serializers import Payload
+
+        event = Event(self.client, header['stream'], None, header.get('deadline'), key=header.get('key'))
+        event.payload = Payload(body, header.get('headers') or {})
+        event.lane = header.get('lane')
+        event.count = header.get('count', 1)
+        self.received += 1
+        self.client.transport.submit(event)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+
+def default_socket():
+    # type: () -> str
+    # not in a world writable directory such as /tmp
+    return os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/run', 'bitcaster-relay.sock')
+
+
+def main(argv=None):
+    from .client import Client
+    from .logging import console
+    from .worker import BatchWorker
+
+    parser = argparse.ArgumentParser(prog='bitcaster-relay', description='Bitcaster host relay')
+    parser.add_argument('--socket', default=default_socket(),
+                        help='unix socket path (default: $XDG_RUNTIME_DIR or /run, bitcaster-relay.sock)')
+    parser.add_argument('--aep', default=os.environ.get('BITCASTER_AEP'),
+                        help='Bitcaster application end point (default: $BITCASTER_AEP)')
+    parser.add_argument('--queue-size', type=int, default=10000)
+    parser.add_argument('--batch-size', type=int, default=50)
+    parser.add_argument('--batch-interval', type=int, default=200, help='milliseconds')
+    parser.add_argument('--pool-maxsize', type=int, default=10)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+    if not args.aep:
+        parser.error('--aep or BITCASTER_AEP is required')
+    console(logging.DEBUG if args.verbose else logging.INFO)
+
+    worker = BatchWorker({'queue_size': args.queue_size, 'batch_size': args.batch_size,
+                          'batch_interval': args.batch_interval})
+    client = Client(args.aep, worker=worker, pool_maxsize=args.pool_maxsize)
+    try:
+        server = RelayServer(args.socket, client)
+    except ConfigurationError as e:
+        parser.error(str(e))
+
+    def stop(signum, frame):
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    logger.info(f'relay listening on {args.socket}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        # drain what is still queued before exiting
+        result = worker.shutdown()
+        logger.info(f'relay stopped: {result["sent"]} sent, {result["failed"]} failed, '
+                    f'{result["abandoned"]} abandoned')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
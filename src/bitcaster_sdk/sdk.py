@@ -1,10 +1,26 @@
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from time import time
+from typing import Optional
 from urllib.parse import urlencode, urlparse
 
-from requests import Session
+from requests import Session, Timeout
 
+from . import atfork
+from .cache import ResponseCache
+from .calllog import CallLog
 from .client import AbstractClient
-from .exceptions import Http404, RemoteAPIException
+from .exceptions import Http404, RemoteAPIException, RequestTimeout
 from .logging import logger
+from .serializers import encode, get_serializer
+from .transport import budget
+
+# absolute deadline of the current `Bitcaster.deadline()` block, if any
+_deadline = ContextVar('bitcaster_deadline', default=None)
 
 
 def avoid_double_slash(path):
@@ -17,44 +33,126 @@ class Bitcaster(AbstractClient):
     url_regex = r"(?P<schema>https?):\/\/(?P<token>.*)@" \
                 r"(?P<host>.*)\/api\/o\/(?P<organization>.*)\/"
 
-    def __init__(self, sdt, user_agent='Bitcaster-API'):
+    def __init__(self, sdt, user_agent='Bitcaster-API', connect_timeout=5, read_timeout=30,
+                 call_log_size=1000, call_log_sample_rate=1.0, cache=None,
+                 discovery_cache=None, discovery_ttl=3600, serializer=None):
         self.sdt = sdt
         self.options = {}
+        self.timeout = (connect_timeout, read_timeout)
         self.parse_url(sdt)
         # self.api_url = api_url
         # parts: ParseResult = urlparse(api_url)
         # self.host = f'{parts.scheme}://{parts.netloc}'
+        self.headers = {'Authorization': f'Token {self.options["token"]}',
+                        'Content-Type': 'application/json',
+                        'Accept-Language': 'it-IT',
+                        'User-Agent': user_agent}
         self.session = Session()
-        self.session.headers.update({'Authorization': f'Token {self.options["token"]}',
-                                     'Content-Type': 'application/json',
-                                     'Accept-Language': 'it-IT',
-                                     'User-Agent': user_agent})
+        self.session.headers.update(self.headers)
+        atfork.register(self)
         self.base_api = None
         self.organization = None
         self.slug = None
         self.conn = None
         self.host = None
-        self.calls = []
+        self.calls = CallLog(call_log_size, call_log_sample_rate)
+        # file where the /ping/ result is kept for `discovery_ttl` seconds
+        self.discovery_cache = discovery_cache
+        self.discovery_ttl = discovery_ttl
+        self._init_lock = threading.Lock()
+        self.serializer = get_serializer(serializer)
+        # opt-in: `True` or a configured ResponseCache
+        self.cache = ResponseCache() if cache is True else cache  # type: Optional[ResponseCache]
 
     @property
     def base_url(self):
         return "{schema}://{host}/api/o/{organization}/".format(**self.options)
 
-    def init(self):
+    def _after_fork_in_child(self):
+        self.session = Session()
+        self.session.headers.update(self.headers)
+        self._init_lock = threading.Lock()
+
+    @contextmanager
+    def deadline(self, seconds):
+        # every call in the block, retries included, must complete
+        # within `seconds`; nested blocks can only shorten it
+        current = _deadline.get()
+        value = time() + seconds
+        token = _deadline.set(value if current is None else min(current, value))
         try:
-            url = "{schema}://{host}/api/system/ping/".format(**self.options)
-            res = self.session.get(url)
-            if res.status_code != 200:
-                raise Exception(f'Error {res.status_code} connecting API: {url}')
-            data = res.json()
-            self.base_api = data['base_api']
-            self.slug = data['slug']
-            self.organization = data['org']
-            self.conn = urlparse(self.base_url)
-            self.host = f'{self.conn.scheme}://{self.conn.netloc}'
-        except Exception as e:
-            logger.exception(e)
-            raise ConnectionError(e)
+            yield
+        finally:
+            _deadline.reset(token)
+
+    def get_timeout(self):
+        # type: () -> tuple
+        return budget(self.timeout, _deadline.get())
+
+    @property
+    def ping_url(self):
+        return "{schema}://{host}/api/system/ping/".format(**self.options)
+
+    def load_discovery(self):
+        # type: () -> Optional[dict]
+        if not self.discovery_cache:
+            return None
+        try:
+            with open(self.discovery_cache) as f:
+                entry = json.load(f)[self.ping_url]
+        except (OSError, ValueError, KeyError):
+            return None
+        if time() - entry['time'] > self.discovery_ttl:
+            return None
+        return entry['data']
+
+    def save_discovery(self, data):
+        if not self.discovery_cache:
+            return
+        try:
+            with open(self.discovery_cache) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            entries = {}
+        entries[self.ping_url] = {'time': time(), 'data': data}
+        tmp = f'{self.discovery_cache}.{os.getpid()}'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(entries, f)
+            os.replace(tmp, self.discovery_cache)
+        except OSError as e:
+            logger.warning(f'unable to save discovery cache: {e}')
+
+    def configure(self, data):
+        self.base_api = data['base_api']
+        self.slug = data['slug']
+        self.organization = data['org']
+        self.conn = urlparse(self.base_url)
+        self.host = f'{self.conn.scheme}://{self.conn.netloc}'
+
+    def init(self):
+        # runs once, even if many threads use a fresh instance
+        with self._init_lock:
+            if self.conn:
+                return
+            data = self.load_discovery()
+            if data is not None:
+                self.configure(data)
+                return
+            url = self.ping_url
+            timeout = self.get_timeout()
+            try:
+                res = self.session.get(url, timeout=timeout)
+                if res.status_code != 200:
+                    raise Exception(f'Error {res.status_code} connecting API: {url}')
+                data = res.json()
+                self.configure(data)
+            except Timeout as e:
+                raise RequestTimeout(f'Timeout connecting API: {url}') from e
+            except Exception as e:
+                logger.exception(e)
+                raise ConnectionError(e)
+            self.save_discovery({k: data[k] for k in ('base_api', 'slug', 'org')})
 
     def get_page(self, path):
         if not self.conn:
@@ -81,12 +179,40 @@ class Bitcaster(AbstractClient):
     #     if res.status_code != 200:
     #         raise RemoteAPIException(res)
 
+    def _send(self, method, full_url, **kwargs):
+        # every request goes through here, so that it is timed and logged
+        body = kwargs.pop('json', None)
+        if body is not None:
+            payload = encode(body, self.serializer)
+            kwargs['data'] = payload.body
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, **payload.headers)
+        entry = None
+        if self.cache is not None and method.lower() == 'get':
+            entry = self.cache.get(full_url)
+            if entry is not None and entry.fresh:
+                return entry.response
+            kwargs['headers'] = self.cache.request_headers(entry)
+        start = time()
+        response = None
+        try:
+            response = self.session.request(method.upper(), full_url, timeout=self.get_timeout(), **kwargs)
+            if self.cache is not None:
+                return self.cache.process(method, full_url, response, entry)
+            return response
+        finally:
+            self.calls.record(method, full_url,
+                              response.status_code if response is not None else None,
+                              time() - start,
+                              len(response.content) if response is not None else 0)
+
     def _invoke(self, method, path, arguments=None):
-        func = getattr(self.session, method.lower(), )
         full_url = self.get_url(path)
         try:
-            self.calls.append(full_url)
-            return func(full_url, json=arguments)
+            return self._send(method, full_url, json=arguments)
+        except RequestTimeout:
+            raise
+        except Timeout as e:
+            raise RequestTimeout(f'Timeout contacting remote server: {full_url}') from e
         except Exception as e:
             logger.exception(e)
             raise Exception(f'Unable to contact remote server: {full_url}')
@@ -98,19 +224,87 @@ class Bitcaster(AbstractClient):
         return self._invoke('post', path, arguments)
 
     def _patch(self, path, arguments):
-        return self.session.patch(self.get_url(path), json=arguments)
+        full_url = self.get_url(path)
+        try:
+            return self._send('patch', full_url, json=arguments)
+        except RequestTimeout:
+            raise
+        except Timeout as e:
+            raise RequestTimeout(f'Timeout contacting remote server: {full_url}') from e
 
     def _delete(self, path):
         full_url = self.get_url(path)
-        self.calls.append(full_url)
-        return self.session.delete(full_url)
+        try:
+            return self._send('delete', full_url)
+        except RequestTimeout:
+            raise
+        except Timeout as e:
+            raise RequestTimeout(f'Timeout contacting remote server: {full_url}') from e
 
     def _put(self, path, arguments):
         return self._invoke('put', path, arguments)
 
+    def _get_page(self, url):
+        res = self._get(url)
+        if res.status_code != 200:
+            raise RemoteAPIException(res)
+        data = res.json()
+        if isinstance(data, dict) and 'results' in data:
+            return data['results'], data.get('next')
+        # not paginated
+        return data, None
+
+    def paginate(self, path, page_size=None, prefetch=True):
+        """
+        yields the items of a list endpoint, following `next` links.
+
+        With `prefetch` the next page is fetched in a background thread
+        while the current one is consumed. `page_size` is sent as a hint.
+        """
+        if page_size:
+            path += ('&' if '?' in path else '?') + urlencode({'page_size': page_size})
+        if not prefetch:
+            url = path
+            while url:
+                items, url = self._get_page(url)
+                yield from items
+            return
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bitcaster_sdk.paginate')
+        try:
+            items, url = self._get_page(path)
+            while True:
+                # the caller context carries the `deadline()` budget to the prefetch thread
+                future = executor.submit(copy_context().run, self._get_page, url) if url else None
+                yield from items
+                if future is None:
+                    break
+                items, url = future.result()
+        finally:
+            executor.shutdown(wait=False)
+
+    def iter_members(self, page_size=None, prefetch=True, **filters):
+        return self.paginate(f'm/?{urlencode(filters)}', page_size, prefetch)
+
+    def iter_org_addresses(self, page_size=None, prefetch=True, **filters):
+        return self.paginate(f'addrs/?{urlencode(filters)}', page_size, prefetch)
+
+    def iter_applications(self, page_size=None, prefetch=True, **filters):
+        return self.paginate(f'a/?{urlencode(filters)}', page_size, prefetch)
+
+    def iter_streams(self, app_id, page_size=None, prefetch=True, **filters):
+        return self.paginate(f'a/{app_id}/s/?{urlencode(filters)}', page_size, prefetch)
+
+    def iter_channels(self, page_size=None, prefetch=True, **filters):
+        return self.paginate(f'c/?{urlencode(filters)}', page_size, prefetch)
+
     def add_member(self, **data):
         return self._post('m/', data)
 
+    def import_members(self, rows, **options):
+        # bulk add_member/add_address/create_assignment, see `importer.Importer`
+        from .importer import Importer
+        return Importer(self, **options).run(rows)
+
     def update_member(self, id, **data):
         return self._put(f'm/{id}/', data)
 
@@ -251,6 +445,11 @@ class Bitcaster(AbstractClient):
         ret = self._get(f'a/{app_id}/s/?{urlencode(filters)}')
         return ret.json()
 
+    def stream_resolver(self, app_id, **kwargs):
+        # es. `init(streams=sdk.stream_resolver(38))`
+        from .streams import StreamResolver
+        return StreamResolver(lambda: self.iter_streams(app_id), **kwargs)
+
     def trigger(self, app_id, pk, payload):
         # http://localhost:8000/api/v0/o/sos/a/50/s/
         ret = self._post(f'a/{app_id}/s/{pk}/trigger/', payload)
@@ -0,0 +1,86 @@
+import gzip
+import json
+from typing import Any, Optional
+
+from .exceptions import ConfigurationError
+
+
+class Serializer:
+    content_type = 'application/json'
+
+    def dumps(self, obj):
+        # type: (Any) -> bytes
+        raise NotImplementedError
+
+
+class JSONSerializer(Serializer):
+    def dumps(self, obj):
+        # same output as requests' `json=`
+        return json.dumps(obj, allow_nan=False).encode()
+
+
+class OrjsonSerializer(Serializer):
+    def __init__(self):
+        try:
+            import orjson
+        except ImportError:
+            raise ConfigurationError('orjson serializer requires `pip install orjson`')
+        self._dumps = orjson.dumps
+
+    def dumps(self, obj):
+        return self._dumps(obj)
+
+
+class MsgpackSerializer(Serializer):
+    # only for servers accepting msgpack request bodies
+    content_type = 'application/msgpack'
+
+    def __init__(self):
+        try:
+            import msgpack
+        except ImportError:
+            raise ConfigurationError('msgpack serializer requires `pip install msgpack`')
+        self._packb = msgpack.packb
+
+    def dumps(self, obj):
+        return self._packb(obj, use_bin_type=True)
+
+
+SERIALIZERS = {'json': JSONSerializer,
+               'orjson': OrjsonSerializer,
+               'msgpack': MsgpackSerializer}
+
+
+def get_serializer(value=None):
+    # type: (Any) -> Serializer
+    # a Serializer instance or one of SERIALIZERS names
+    if isinstance(value, Serializer):
+        return value
+    try:
+        return SERIALIZERS[value or 'json']()
+    except KeyError:
+        raise ConfigurationError(f'Unknown serializer "{value}". Valid values are {", ".join(SERIALIZERS)}')
+
+
+class Payload:
+    # request body ready to be sent, built once when the event is queued
+    __slots__ = ('body', 'headers')
+
+    def __init__(self, body, headers):
+        self.body = body
+        self.headers = headers
+
+    def __len__(self):
+        return len(self.body)
+
+
+def encode(obj, serializer, compress_threshold=None):
+    # type: (Any, Serializer, Optional[int]) -> Payload
+    if isinstance(obj, Payload):
+        return obj
+    body = serializer.dumps(obj)
+    headers = {'Content-Type': serializer.content_type}
+    if compress_threshold is not None and len(body) > compress_threshold:
+        body = gzip.compress(body, compresslevel=6)
+        headers['Content-Encoding'] = 'gzip'
+    return Payload(body, headers)
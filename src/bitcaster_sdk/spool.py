@@ -0,0 +1,200 @@
+import json
+import os
+import threading
+from typing import Iterator, Optional
+
+from .logging import logger
+
+
+class Segment:
+    def __init__(self, path):
+        self.path = path
+        self.ack_path = path[:-4] + '.ack'
+        self.size = 0
+        self.pending = {}  # record id -> offset
+        self.acked = set()
+
+    @property
+    def name(self):
+        return os.path.basename(self.path)
+
+    def load(self):
+        # type: () -> int
+        last_id = 0
+        if os.path.exists(self.ack_path):
+            with open(self.ack_path) as f:
+                self.acked = {int(line) for line in f if line.strip()}
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record_id = json.loads(line)['id']
+                except (ValueError, KeyError):
+                    # torn write at crash time
+                    logger.warning(f'spool: skipping corrupted record in {self.name}')
+                    continue
+                finally:
+                    line_offset, offset = offset, offset + len(line)
+                last_id = max(last_id, record_id)
+                if record_id not in self.acked:
+                    self.pending[record_id] = line_offset
+        self.size = os.path.getsize(self.path)
+        return last_id
+
+    def records(self):
+        # type: () -> Iterator[dict]
+        with open(self.path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record['id'] in self.pending:
+                    yield record
+
+    def read(self, offset):
+        # type: (int) -> dict
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.readline())
+
+    def remove(self):
+        for path in (self.path, self.ack_path):
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+class Spool:
+    """
+    append-only on-disk log of queued events.
+
+    Records are appended as JSON lines to the current segment, which is
+    rotated after `segment_size` bytes. Acknowledged ids are appended to a
+    sibling `.ack` file and segments are deleted once every record in them
+    is acknowledged. When the spool grows over `max_bytes` the oldest
+    segments are discarded and counted in `dropped`.
+    """
+
+    def __init__(self, path, segment_size=1024 * 1024, max_bytes=64 * 1024 * 1024, fsync=False):
+        self.path = path
+        self.segment_size = segment_size
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._segments = []  # type: list
+        self._index = {}  # record id -> Segment
+        self._file = None
+        self._last_id = 0
+        os.makedirs(path, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        for name in sorted(os.listdir(self.path)):
+            if not name.endswith('.log'):
+                continue
+            segment = Segment(os.path.join(self.path, name))
+            self._last_id = max(self._last_id, segment.load())
+            if not segment.size:
+                segment.remove()
+                continue
+            for record_id in segment.pending:
+                self._index[record_id] = segment
+            self._segments.append(segment)
+        self._compact()
+
+    @property
+    def size(self):
+        # type: () -> int
+        return sum(s.size for s in self._segments)
+
+    def __len__(self):
+        return len(self._index)
+
+    def _current(self, needed):
+        # type: (int) -> Segment
+        current = self._segments[-1] if self._segments else None
+        if current is None or current.size + needed > self.segment_size or self._file is None:
+            if self._file:
+                self._file.close()
+            current = Segment(os.path.join(self.path, '%012d.log' % (self._last_id + 1)))
+            self._segments.append(current)
+            self._file = open(current.path, 'ab')
+            self._compact()
+        return current
+
+    def append(self, record):
+        # type: (dict) -> Optional[int]
+        with self._lock:
+            record_id = self._last_id + 1
+            line = json.dumps(dict(record, id=record_id)).encode() + b'\n'
+            segment = self._current(len(line))
+            self._enforce_budget(len(line))
+            if self.size + len(line) > self.max_bytes:
+                self.dropped += 1
+                logger.warning('spool is full, event not persisted')
+                return None
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._last_id = record_id
+            segment.pending[record_id] = segment.size
+            segment.size += len(line)
+            self._index[record_id] = segment
+            return record_id
+
+    def ack(self, record_id):
+        # type: (int) -> None
+        with self._lock:
+            segment = self._index.pop(record_id, None)
+            if segment is None:
+                return
+            segment.pending.pop(record_id, None)
+            if not segment.pending and segment is not self._segments[-1]:
+                self._drop(segment)
+                return
+            with open(segment.ack_path, 'a') as f:
+                f.write(f'{record_id}\n')
+
+    def read(self, record_id):
+        # type: (int) -> Optional[dict]
+        with self._lock:
+            segment = self._index.get(record_id)
+            if segment is None:
+                return None
+            return segment.read(segment.pending[record_id])
+
+    def pending(self):
+        # type: () -> Iterator[dict]
+        for segment in list(self._segments):
+            yield from segment.records()
+
+    def _drop(self, segment):
+        segment.remove()
+        self._segments.remove(segment)
+
+    def _compact(self):
+        # remove fully acknowledged segments, except the one being written
+        for segment in self._segments[:-1]:
+            if not segment.pending:
+                self._drop(segment)
+
+    def _enforce_budget(self, needed):
+        while self.size + needed > self.max_bytes and len(self._segments) > 1:
+            oldest = self._segments[0]
+            self.dropped += len(oldest.pending)
+            logger.warning(f'spool over budget, discarding {len(oldest.pending)} events')
+            for record_id in oldest.pending:
+                self._index.pop(record_id, None)
+            self._drop(oldest)
+
+    def compact(self):
+        with self._lock:
+            self._compact()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
@@ -0,0 +1,110 @@
+import threading
+from time import monotonic
+from typing import Callable, Iterable, Optional
+
+from . import atfork
+from .exceptions import StreamNotFound
+from .logging import logger
+
+
+def stream_id(stream):
+    # type: (object) -> Optional[int]
+    # numeric ids (or their string form) need no lookup
+    if isinstance(stream, int):
+        return stream
+    if isinstance(stream, str) and stream.isdigit():
+        return int(stream)
+    return None
+
+
+class StreamResolver:
+    """
+    maps stream slugs and names to ids.
+
+    The whole stream list of the application is loaded with one `fetch()`
+    call, at the first miss or by `start()`, that also refreshes it every
+    `refresh_interval` seconds in a background thread. Concurrent misses
+    share a single `fetch()`; names still unknown after a refresh raise
+    StreamNotFound without fetching again for `miss_interval` seconds.
+    """
+
+    def __init__(self, fetch, refresh_interval=300, miss_interval=10):
+        # type: (Callable[[], Iterable[dict]], float, float) -> None
+        self.fetch = fetch
+        self.refresh_interval = refresh_interval
+        self.miss_interval = miss_interval
+        self.generation = 0
+        self.refreshed = None  # type: Optional[float]
+        self._ids = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        atfork.register(self)
+
+    def _after_fork_in_child(self):
+        self._lock = threading.Lock()
+        if self._thread is not None and not self._stop.is_set():
+            self._thread = None
+            self.start()
+
+    def update(self, streams):
+        # type: (Iterable[dict]) -> None
+        ids = {}
+        for stream in streams:
+            for key in ('slug', 'name'):
+                if stream.get(key):
+                    ids.setdefault(stream[key], stream['id'])
+        self._ids = ids
+        self.refreshed = monotonic()
+        self.generation += 1
+
+    def lookup(self, stream):
+        # type: (object) -> Optional[int]
+        # no I/O, None if unknown
+        ret = stream_id(stream)
+        return ret if ret is not None else self._ids.get(stream)
+
+    def stale(self, generation):
+        # type: (int) -> bool
+        # nobody refreshed since `generation` and the last refresh is old enough
+        return self.generation == generation and (
+            self.refreshed is None or monotonic() - self.refreshed > self.miss_interval)
+
+    def refresh(self, generation=None):
+        # type: (Optional[int]) -> None
+        generation = self.generation if generation is None else generation
+        with self._lock:
+            if self.stale(generation):
+                self.update(self.fetch())
+
+    def resolve(self, stream):
+        # type: (object) -> int
+        ret = self.lookup(stream)
+        if ret is None:
+            self.refresh(self.generation)
+            ret = self.lookup(stream)
+        if ret is None:
+            raise StreamNotFound(f'Unknown stream "{stream}"')
+        return ret
+
+    def warm_up(self):
+        with self._lock:
+            self.update(self.fetch())
+
+    def _run(self):
+        while True:
+            try:
+                self.warm_up()
+            except Exception as e:
+                logger.warning(f'unable to refresh streams: {e}')
+            if self._stop.wait(self.refresh_interval):
+                return
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='bitcaster_sdk.streams', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
@@ -1,23 +1,76 @@
-from contextlib import contextmanager
+from time import time
+from typing import Optional
 from urllib.parse import urlparse
 
 import requests
+from requests.adapters import HTTPAdapter
 
+from . import atfork
+from .exceptions import DeadlineExceeded, RequestTimeout
 from .logging import logger
+from .ratelimit import RateLimiter, retry_after
+from .serializers import Payload, encode, get_serializer
 from .worker import SynchronousWorker
 
 
+def budget(timeout, deadline=None):
+    # type: (tuple, Optional[float]) -> tuple
+    # caps a (connect, read) timeout to what is left before `deadline`
+    if deadline is None:
+        return timeout
+    remaining = deadline - time()
+    if remaining <= 0:
+        raise DeadlineExceeded('Deadline exceeded')
+    connect, read = timeout if isinstance(timeout, tuple) else (timeout, timeout)
+    return min(connect, remaining), min(read, remaining)
+
+
 class Transport:
+    # session state is only written here: requests then use per-call headers,
+    # so a single Transport can be shared by any number of sender threads.
     def __init__(self, base_url, token, **kwargs):
-        self.session = requests.Session()
         self.base_url = base_url
+        self.token = token
+        self.options = kwargs
         self.debug = kwargs.get('debug')
-        self.session.headers.update({'Authorization': f'Key {token}',
-                                     'User-Agent': 'Bitcaster-SDK'})
+        self._setup_session()
         self.conn = urlparse(base_url)
-        # self.thread = BackgroundWorker()
-        self.thread = SynchronousWorker()
+        # rate_limit/rate_burst: whole application; stream_rate_limit/stream_rate_burst: each stream
+        # rate_limit_block: wait for a token instead of raising RateLimited
+        self.limiter = RateLimiter(kwargs.get('rate_limit'), kwargs.get('rate_burst'),
+                                   kwargs.get('stream_rate_limit'), kwargs.get('stream_rate_burst'))
+        self.rate_limit_block = kwargs.get('rate_limit_block', False)
+        self.timeout = (kwargs.get('connect_timeout', 5), kwargs.get('read_timeout', 30))
+        # serializer: 'json', 'orjson', 'msgpack' or a Serializer
+        # compress_threshold: gzip bodies larger than this many bytes (the server must accept it)
+        self.serializer = get_serializer(kwargs.get('serializer'))
+        self.compress_threshold = kwargs.get('compress_threshold')
+        # any AbstractWorker: SynchronousWorker, BackgroundWorker, BatchWorker
+        self.thread = kwargs.get('worker') or SynchronousWorker()
         self.thread.start()
+        atfork.register(self)
+
+    def _setup_session(self):
+        kwargs = self.options
+        self.session = requests.Session()
+        # pool_connections: number of per-host pools kept
+        # pool_maxsize: max connections kept open per host
+        # pool_block: wait for a free connection instead of opening extra ones
+        self.adapter = HTTPAdapter(pool_connections=kwargs.get('pool_connections', 10),
+                                   pool_maxsize=kwargs.get('pool_maxsize', 10),
+                                   pool_block=kwargs.get('pool_block', False))
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+        self.session.headers.update({'Authorization': f'Key {self.token}',
+                                     'User-Agent': 'Bitcaster-SDK'})
+        if not kwargs.get('keep_alive', True):
+            self.session.headers['Connection'] = 'close'
+
+    def _after_fork_in_child(self):
+        # pooled sockets are shared with the parent: start from fresh ones
+        self._setup_session()
+        self.limiter = RateLimiter(self.options.get('rate_limit'), self.options.get('rate_burst'),
+                                   self.options.get('stream_rate_limit'), self.options.get('stream_rate_burst'))
 
     def get_url(self, path):
         if path.startswith('/'):
@@ -25,24 +78,51 @@ class Transport:
         else:
             return f"{self.conn.scheme}://{self.conn.netloc}{self.conn.path}{path}"
 
-    @contextmanager
-    def with_headers(self, values: dict):
-        c = dict(self.session.headers)
-        self.session.headers.update(values)
-        yield
-        self.session.headers = c
+    def encode(self, arguments):
+        # type: (object) -> Payload
+        return encode(arguments, self.serializer, self.compress_threshold)
 
-    def get(self, path):
+    def get(self, path, timeout=None, deadline=None):
         if self.debug:
             logger.info(f"get {path}")
+        timeout = budget(timeout or self.timeout, deadline)
+        try:
+            return self.session.get(self.get_url(path), timeout=timeout)
+        except requests.Timeout as e:
+            raise RequestTimeout(f'Timeout getting {path}') from e
 
-        return self.session.get(self.get_url(path))
-
-    def post(self, path, arguments):
+    def post(self, path, arguments, stream=None, timeout=None, deadline=None, headers=None):
         if self.debug:
             logger.info(f"post {path}")
-        with self.with_headers({'Content-Type': 'application/json'}):
-            return self.session.post(self.get_url(path), json=arguments)
+        self.limiter.acquire(stream, block=self.rate_limit_block,
+                             timeout=deadline - time() if deadline else None)
+        timeout = budget(timeout or self.timeout, deadline)
+        payload = self.encode(arguments)
+        try:
+            response = self.session.post(self.get_url(path), data=payload.body,
+                                         headers=dict(payload.headers, **(headers or {})),
+                                         timeout=timeout)
+        except requests.Timeout as e:
+            raise RequestTimeout(f'Timeout posting to {path}') from e
+        if response.status_code == 429:
+            self.limiter.pause(retry_after(response), stream)
+        return response
+
+    def pool_stats(self):
+        # type: () -> dict
+        opened = requests_ = 0
+        pools = self.adapter.poolmanager.pools
+        for key in pools.keys():
+            try:
+                pool = pools[key]
+            except KeyError:  # evicted meanwhile
+                continue
+            opened += pool.num_connections
+            requests_ += pool.num_requests
+        return {'pools': len(pools),
+                'requests': requests_,
+                'opened': opened,
+                'reused': max(requests_ - opened, 0)}
 
     def submit(self, callback):
         self.thread.submit(callback)
@@ -1,15 +1,29 @@
 import atexit
+import heapq
+import itertools
 import os
+import random
 import threading
-from queue import Full, Queue
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Full, Queue
 from time import sleep, time
 from typing import Callable, Optional
 
-from requests.exceptions import ConnectionError, HTTPError
+from requests.exceptions import ConnectionError, HTTPError, Timeout
 
+from . import atfork, metrics
+from .exceptions import (ConfigurationError, DeadlineExceeded, RateLimited,
+                         ServerError)
 from .logging import logger
 
 _TERMINATOR = object()
+# makes a consumer blocked in LaneQueue.get() return, see LaneQueue.nudge()
+_NUDGE = object()
+
+_worker_ids = itertools.count(1)
+
+RETRYABLE = (HTTPError, ConnectionError, Timeout, ServerError)
 
 
 def check_thread_support():
@@ -37,7 +51,136 @@ def check_thread_support():
         )
 
 
+OVERFLOW_POLICIES = ('drop_newest', 'drop_oldest', 'block', 'sample', 'spill')
+
+# what a forked child does with the events queued by the parent:
+# 'discard': the parent keeps sending them; 'handoff': the next child takes them over
+FORK_POLICIES = ('discard', 'handoff')
+
+DEFAULT_LANE = 'default'
+
+
+class LaneQueue(Queue):
+    """
+    Queue with one FIFO lane per priority.
+
+    `lanes` maps each lane to {'weight': int, 'size': int}: lanes are
+    served by smooth weighted round robin, so a lane with weight 4 gets 4
+    turns for each turn of a lane with weight 1 and no lane starves.
+    `size` (optional) caps the lane on top of the overall `maxsize`.
+    `classify(item)` returns the lane of an item. Terminators bypass the
+    limits and are returned only when every lane is empty.
+    """
+
+    def __init__(self, maxsize=0, lanes=None, classify=None):
+        self.lane_options = lanes or {DEFAULT_LANE: {'weight': 1}}
+        self.classify = classify or (lambda item: DEFAULT_LANE)
+        super().__init__(maxsize)
+
+    def _init(self, maxsize):
+        self.lanes = {name: deque() for name in self.lane_options}
+        self.weights = {name: opts.get('weight', 1) for name, opts in self.lane_options.items()}
+        self.limits = {name: opts.get('size') for name, opts in self.lane_options.items()}
+        self._current = dict.fromkeys(self.lanes, 0)
+        self._control = deque()
+
+    @property
+    def queue(self):
+        # queued items, lane by lane, like Queue.queue
+        return deque(item for lane in self.lanes.values() for item in lane)
+
+    def _qsize(self):
+        return sum(len(lane) for lane in self.lanes.values()) + len(self._control)
+
+    def _put(self, item):
+        if item is _TERMINATOR:
+            self._control.append(item)
+            return
+        lane = self.classify(item)
+        limit = self.limits[lane]
+        if limit and len(self.lanes[lane]) >= limit:
+            # raised before the task counter is updated, see Queue.put
+            raise Full
+        self.lanes[lane].append(item)
+
+    def _get(self):
+        ready = [name for name, lane in self.lanes.items() if lane]
+        if not ready:
+            return self._control.popleft()
+        total = 0
+        for name in ready:
+            self._current[name] += self.weights[name]
+            total += self.weights[name]
+        selected = max(ready, key=self._current.get)
+        self._current[selected] -= total
+        return self.lanes[selected].popleft()
+
+    def put(self, item, block=True, timeout=None):
+        if item is _TERMINATOR:
+            # wake up consumers even when the queue is full
+            with self.not_full:
+                self._put(item)
+                self.unfinished_tasks += 1
+                self.not_empty.notify()
+            return
+        super().put(item, block, timeout)
+
+    def nudge(self):
+        # type: () -> None
+        # wakes up a consumer blocked in get(), which receives _NUDGE.
+        # Not a task: it is not counted in `unfinished_tasks`
+        with self.not_empty:
+            if _NUDGE not in self._control:
+                self._control.appendleft(_NUDGE)
+                self.not_empty.notify()
+
+    def lane_full(self, lane):
+        # type: (str) -> bool
+        limit = self.limits[lane]
+        with self.mutex:
+            return bool(limit) and len(self.lanes[lane]) >= limit
+
+    def evict(self, lane):
+        # type: (str) -> object
+        # removes the oldest item of `lane` if it is full, otherwise of the
+        # lowest weight lane with items. None if there is nothing to evict
+        with self.mutex:
+            limit = self.limits[lane]
+            if not (limit and len(self.lanes[lane]) >= limit):
+                ready = [name for name, items in self.lanes.items() if items]
+                if not ready:
+                    return None
+                lane = min(ready, key=self.weights.get)
+            if not self.lanes[lane]:
+                return None
+            item = self.lanes[lane].popleft()
+            self.not_full.notify()
+            return item
+
+    def sizes(self):
+        # type: () -> dict
+        with self.mutex:
+            return {name: len(lane) for name, lane in self.lanes.items()}
+
+    def take_all(self):
+        # type: () -> list
+        # removes and returns every queued item, except terminators.
+        # Caller must hold `mutex`
+        items = [item for lane in self.lanes.values() for item in lane]
+        for lane in self.lanes.values():
+            lane.clear()
+        self.unfinished_tasks -= len(items)
+        if not self.unfinished_tasks:
+            self.all_tasks_done.notify_all()
+        self.not_full.notify_all()
+        return items
+
+
 class AbstractWorker:
+    spool = None
+    # callable(record) -> callback, to rebuild spooled events (see Client)
+    loader = None
+
     def __init__(self, options: dict = None):
         pass
 
@@ -53,6 +196,15 @@ class AbstractWorker:
     def terminate(self):
         raise NotImplementedError()
 
+    def flush(self, timeout=None):
+        # type: (Optional[float]) -> dict
+        return {'sent': 0, 'failed': 0, 'pending': 0}
+
+    def shutdown(self, timeout=None):
+        # type: (Optional[float]) -> dict
+        self.terminate()
+        return {'sent': 0, 'failed': 0, 'abandoned': 0}
+
 
 class SynchronousWorker(AbstractWorker):
     def submit(self, callback):
@@ -69,16 +221,60 @@ class BackgroundWorker(AbstractWorker):
     def __init__(self, options: dict = None):
         super().__init__(options)
         check_thread_support()
+        # backoff: base delay (seconds) of the first retry, doubled on each
+        # attempt up to `max_backoff`
+        # dead_letter: callable(callback, exception) for events given up on
+        # max_throttled: 429 retries of an event, not counted in max_attempts, before giving up
+        # drain_threads: senders used by flush()/shutdown(), the calling thread included
+        # shutdown_spill: callable(callbacks) for the events still unsent when shutdown() times out
+        # name: `worker` label of the metrics, defaults to the class name and a sequence number
         self.options = {'queue_size': 100, 'shutdown_timeout': 10,
-                        'pause_on_error': 10, 'backoff': 1}
+                        'pause_on_error': 10, 'backoff': 1, 'max_backoff': 60,
+                        'max_attempts': 5, 'max_throttled': 20, 'dead_letter': None,
+                        'overflow': 'drop_newest', 'block_timeout': 1, 'sample_rate': 0.1,
+                        'queue_bytes': None,
+                        'spool': None,
+                        # lanes: {name: {'weight': int, 'size': int}}, None for a single FIFO
+                        # stream_lanes: {stream: lane}, used for events without an explicit lane
+                        'lanes': None, 'default_lane': None, 'stream_lanes': {},
+                        'fork_policy': 'discard',
+                        'drain_threads': 4, 'shutdown_spill': None, 'name': None}
         if options:
             self.options.update(options)
+        if self.options['overflow'] not in OVERFLOW_POLICIES:
+            raise ConfigurationError(f'Invalid overflow policy "{self.options["overflow"]}"')
+        if self.options['overflow'] == 'spill' and self.options['spool'] is None:
+            raise ConfigurationError('"spill" overflow policy requires a spool')
+        if self.options['fork_policy'] not in FORK_POLICIES:
+            raise ConfigurationError(f'Invalid fork policy "{self.options["fork_policy"]}"')
+        self.spool = self.options['spool']
+        self.name = self.options['name'] or f'{type(self).__name__}-{next(_worker_ids)}'
         self.terminating = False
         self.errors = 0
-        self._queue = Queue(self.options['queue_size'])  # type: Queue
+        self.dropped = Counter()  # reason -> count
+        self.spilled = 0
+        self.sent = 0
+        self.failed = 0
+        self._counts_lock = threading.Lock()
+        if self.options['lanes'] and (self.options['default_lane'] or DEFAULT_LANE) not in self.options['lanes']:
+            raise ConfigurationError('"default_lane" must be one of the configured lanes')
+        self._queue = LaneQueue(self.options['queue_size'], self.options['lanes'], self.lane_of)
+        # payload bytes held by queued (or retrying) events, see `queue_bytes`
+        self._bytes = 0
+        self._space = threading.Condition()
+        self._spilled = deque()  # type: deque
+        metrics.QUEUE_DEPTH.set_function(self._queue.qsize, worker=self.name)
+        # (due, seq, attempts, callback). Retried events stay "unfinished"
+        # in the queue until they are sent or dead-lettered
+        self._retries = []  # type: list
+        self._retry_lock = threading.Lock()
+        self._seq = 0
+        self._throttled = {}  # id(callback) -> 429 retries so far
         self._lock = threading.Lock()
         self._thread = None  # type: Optional[threading.Thread]
         self._thread_for_pid = None  # type: Optional[int]
+        self._atexit = False
+        atfork.register(self)
 
     @property
     def is_alive(self):
@@ -92,10 +288,162 @@ class BackgroundWorker(AbstractWorker):
     def submit(self, callback):
         # type: (Callable[[], None]) -> None
         self._ensure_thread()
-        try:
-            self._queue.put_nowait(callback)
-        except Full:
-            logger.debug("background worker queue full, dropping event")
+        self._persist(callback)
+        policy = self.options['overflow']
+        if policy == 'block':
+            accepted = self._offer(callback, self.options['block_timeout'])
+        else:
+            accepted = self._offer(callback)
+        if not accepted:
+            self._overflow(policy, callback)
+
+    def resume(self, callback):
+        # type: (Callable[[], None]) -> None
+        # queue an already spooled event. It is never dropped: if there is
+        # no room it waits on disk like a spilled one
+        self._ensure_thread()
+        if not self._offer(callback):
+            self._spilled.append(callback.spool_id)
+
+    def _stream_lane(self, callback):
+        # type: (Callable[[], None]) -> Optional[str]
+        # `stream_lanes` keys and queued streams can be ids, slugs or names:
+        # they match if the client stream resolver maps them to the same id
+        stream_lanes = self.options['stream_lanes']
+        stream = getattr(callback, 'stream', None)
+        lane = stream_lanes.get(stream)
+        if lane is not None or stream is None or not stream_lanes:
+            return lane
+        streams = getattr(getattr(callback, 'client', None), 'streams', None)
+        if streams is None:
+            return None
+        resolved = streams.lookup(stream)  # no I/O
+        if resolved is None:
+            return None
+        for key, lane in stream_lanes.items():
+            if streams.lookup(key) == resolved:
+                return lane
+        return None
+
+    def lane_of(self, callback):
+        # type: (Callable[[], None]) -> str
+        lane = getattr(callback, 'lane', None) or self._stream_lane(callback)
+        if lane not in self._queue.lanes:
+            lane = self.options['default_lane'] or DEFAULT_LANE
+        return lane
+
+    @staticmethod
+    def _sizeof(callback):
+        # type: (Callable[[], None]) -> int
+        return getattr(callback, 'size', 0)
+
+    def _has_room(self, size, lane=DEFAULT_LANE):
+        # type: (int, str) -> bool
+        if self._queue.full() or self._queue.lane_full(lane):
+            return False
+        # events waiting for a retry count against `queue_size` too
+        maxsize = self.options['queue_size']
+        if maxsize and self._queue.qsize() + len(self._retries) >= maxsize:
+            return False
+        limit = self.options['queue_bytes']
+        # a single event bigger than the limit is accepted on an empty queue
+        return not limit or not self._bytes or self._bytes + size <= limit
+
+    def _offer(self, callback, timeout=0):
+        # type: (Callable[[], None], float) -> bool
+        size = self._sizeof(callback)
+        lane = self.lane_of(callback)
+        deadline = time() + timeout
+        with self._space:
+            while not self._has_room(size, lane):
+                remaining = deadline - time()
+                if remaining <= 0:
+                    return False
+                # slots are freed by the consumer without notifying, so poll
+                self._space.wait(min(remaining, 0.05))
+            try:
+                self._queue.put_nowait(callback)
+            except Full:
+                return False
+            self._bytes += size
+        metrics.ENQUEUED.inc()
+        return True
+
+    def _overflow(self, policy, callback):
+        # type: (str, Callable[[], None]) -> None
+        if policy == 'spill':
+            self._spill(callback)
+            return
+        if policy == 'drop_oldest' or (policy == 'sample' and random.random() < self.options['sample_rate']):
+            if self._evict_oldest(self.lane_of(callback)) and self._offer(callback):
+                return
+        reason = 'timeout' if policy == 'block' else 'newest'
+        self.dropped[reason] += 1
+        metrics.DROPPED.inc(reason=reason)
+        self._ack(callback)
+        logger.debug(f"background worker queue full, dropping event ({policy})")
+
+    def _evict_oldest(self, lane=DEFAULT_LANE):
+        # type: (str) -> bool
+        oldest = self._queue.evict(lane)
+        if oldest is None:
+            return False
+        self.dropped['oldest'] += 1
+        metrics.DROPPED.inc(reason='oldest')
+        self._ack(oldest)
+        self._queue.task_done()
+        self._release(oldest)
+        return True
+
+    def _spill(self, callback):
+        # type: (Callable[[], None]) -> None
+        if self.spool is not None and getattr(callback, 'spool_id', None) is None and hasattr(callback, 'serialize'):
+            callback.spool_id = self.spool.append(callback.serialize())
+        if getattr(callback, 'spool_id', None) is None:
+            self.dropped['newest'] += 1
+            metrics.DROPPED.inc(reason='newest')
+            logger.debug("background worker queue full, unable to spill event")
+            return
+        self.spilled += 1
+        self._spilled.append(callback.spool_id)
+
+    def _refill(self):
+        # type: () -> None
+        # move spilled events back from the spool while there is room
+        while self._spilled and self.loader:
+            record = self.spool.read(self._spilled[0])
+            if record is None:  # dropped by the spool budget
+                self._spilled.popleft()
+                continue
+            if not self._offer(self.loader(record)):
+                return
+            self._spilled.popleft()
+
+    def _release(self, callback):
+        # type: (Callable[[], None]) -> None
+        self._throttled.pop(id(callback), None)
+        size = self._sizeof(callback)
+        if size:
+            with self._space:
+                self._bytes -= size
+                self._space.notify()
+
+    def _done(self, callback):
+        # type: (Callable[[], None]) -> None
+        self._queue.task_done()
+        self._release(callback)
+
+    def _persist(self, callback):
+        # only events that can be serialized (see client.Event) are spooled
+        if self.spool is None or not hasattr(callback, 'serialize'):
+            return
+        if getattr(callback, 'spool_id', None) is None:
+            callback.spool_id = self.spool.append(callback.serialize())
+
+    def _ack(self, callback):
+        spool_id = getattr(callback, 'spool_id', None)
+        if self.spool is not None and spool_id is not None:
+            self.spool.ack(spool_id)
 
     def _ensure_thread(self):
         # type: () -> None
@@ -126,38 +474,142 @@ class BackgroundWorker(AbstractWorker):
         finally:
             queue.all_tasks_done.release()
 
-    def main_thread_terminated(self):
-        with self._lock:
-            if not self.is_alive:
-                # thread not started or already stopped - nothing to do
-                return
+    def _count(self, sent=0, failed=0):
+        # type: (int, int) -> None
+        with self._counts_lock:
+            self.sent += sent
+            self.failed += failed
 
-            # wake the processing thread up
-            self._queue.put_nowait(_TERMINATOR)
+    def _pending(self):
+        # type: () -> int
+        # queued, retrying or being sent
+        return self._queue.unfinished_tasks + len(self._spilled)
+
+    def empty(self):
+        # type: () -> bool
+        return self._pending() == 0
 
-            timeout = self.options['shutdown_timeout']
+    def _drain_step(self, timeout):
+        # type: (float) -> bool
+        # sends the next due event, if any. False if the worker is stopping
+        attempts, callback = self._next(timeout)
+        if callback is _TERMINATOR:
+            # meant for the worker thread: give it back
+            self._queue.task_done()
+            self._queue.put(_TERMINATOR)
+            return False
+        if callback is not None:
+            self._handle(callback, attempts)
+        return True
 
-            # wait briefly, initially
-            initial_timeout = min(0.1, timeout)
+    def _drain_loop(self, deadline, stop):
+        # type: (float, threading.Event) -> None
+        while not stop.is_set() and self._pending():
+            remaining = deadline - time()
+            if remaining <= 0 or not self._drain_step(min(remaining, 0.05)):
+                return
 
-            if not self._timed_queue_join(initial_timeout):
-                # if that didn't work, wait a bit longer
-                # NB that size is an approximation, because other threads may
-                # add or remove items
-                size = self._queue.qsize()
+    def _drain(self, deadline):
+        # type: (float) -> None
+        # the calling thread and `drain_threads - 1` helpers send next to
+        # the worker thread(s) until nothing is pending or `deadline`
+        stop = threading.Event()
+        helpers = []
+        for i in range(self.options['drain_threads'] - 1):
+            if self._queue.qsize() <= i:
+                break
+            helper = threading.Thread(target=self._drain_loop, args=(deadline, stop),
+                                      name=f'bitcaster_sdk.drain-{i}', daemon=True)
+            try:
+                helper.start()
+            except RuntimeError:  # no new threads at interpreter shutdown
+                break
+            helpers.append(helper)
+        try:
+            self._drain_loop(deadline, stop)
+        finally:
+            stop.set()
+        # idle helpers return within one poll: do not let them take events queued after flush()
+        for helper in helpers:
+            helper.join(max(deadline - time(), 0.1))
+        # retries scheduled by these threads are not seen by a worker thread
+        # blocked on an empty queue, or waiting for a later retry
+        if self._retries and self.is_alive:
+            self._queue.nudge()
 
-                print("Bitcaster is attempting to send %i pending notifications"
-                      % size)
-                print("Waiting up to %s seconds" % timeout)
+    def flush(self, timeout=None):
+        # type: (Optional[float]) -> dict
+        """
+        sends the queued events and the pending retries, in parallel, for at
+        most `timeout` seconds (default `shutdown_timeout`).
 
-                if os.name == 'nt':
-                    print("Press Ctrl-Break to quit")
-                else:
-                    print("Press Ctrl-C to quit")
+        Returns {'sent': n, 'failed': n, 'pending': n}: events not sent in
+        time stay queued.
+        """
+        timeout = self.options['shutdown_timeout'] if timeout is None else timeout
+        sent, failed = self.sent, self.failed
+        self._drain(time() + timeout)
+        return {'sent': self.sent - sent, 'failed': self.failed - failed, 'pending': self._pending()}
 
-                self._timed_queue_join(timeout - initial_timeout)
+    def _take_leftovers(self):
+        # type: () -> list
+        with self._queue.mutex:
+            items = self._queue.take_all()
+        with self._retry_lock:
+            retries, self._retries = self._retries, []
+        for __ in retries:
+            self._queue.task_done()
+        items += [callback for *__, callback in retries]
+        for callback in items:
+            self._release(callback)
+        return items
+
+    def _abandon(self, leftovers):
+        # type: (list) -> None
+        if not leftovers:
+            return
+        if self.options['shutdown_spill']:
+            try:
+                self.options['shutdown_spill'](leftovers)
+            except Exception:
+                logger.error("Error in shutdown_spill hook", exc_info=True)
+            else:
+                for callback in leftovers:
+                    self._ack(callback)
+                return
+        if self.spool is not None:
+            # not acked: the next process replays them
+            logger.warning(f'{len(leftovers)} unsent events left in the spool')
+            return
+        self.dropped['shutdown'] += len(leftovers)
+        metrics.DROPPED.inc(len(leftovers), reason='shutdown')
+        logger.warning(f'Abandoning {len(leftovers)} unsent events')
 
+    def shutdown(self, timeout=None):
+        # type: (Optional[float]) -> dict
+        """
+        flushes for at most `timeout` seconds (default `shutdown_timeout`),
+        then stops the worker thread(s). Events still unsent are handed to
+        `shutdown_spill`, left in the spool or dropped.
+
+        Returns {'sent': n, 'failed': n, 'abandoned': n}.
+        """
+        timeout = self.options['shutdown_timeout'] if timeout is None else timeout
+        pending = self._pending()
+        if pending:
+            logger.info(f'sending {pending} pending events, waiting up to {timeout} seconds')
+        result = self.flush(timeout)
+        leftovers = self._take_leftovers()
+        with self._lock:
+            if self.is_alive:
+                self._wake_up()
             self._thread = None
+        self._abandon(leftovers)
+        return {'sent': result['sent'], 'failed': result['failed'], 'abandoned': len(leftovers)}
+
+    def main_thread_terminated(self):
+        # atexit
+        self.shutdown()
 
     def start(self):
         # type: () -> None
@@ -171,36 +623,553 @@ class BackgroundWorker(AbstractWorker):
                     self._thread.start()
                     self._thread_for_pid = os.getpid()
             finally:
-                atexit.register(self.main_thread_terminated)
+                self._register_atexit()
+
+    def _register_atexit(self):
+        # once: a forked child inherits the parent registration
+        if not self._atexit:
+            atexit.register(self.main_thread_terminated)
+            self._atexit = True
+
+    def _before_fork(self):
+        # the child gets a consistent copy of queue and retries
+        self._queue.mutex.acquire()
+        self._retry_lock.acquire()
+
+    def _after_fork_in_parent(self):
+        try:
+            if self.options['fork_policy'] == 'handoff':
+                pending = self._queue.take_all() + [callback for *__, callback in self._retries]
+                self._queue.unfinished_tasks -= len(self._retries)
+                self._retries = []
+                if pending:
+                    logger.debug(f'handing {len(pending)} pending events off to the forked process')
+            else:
+                pending = []
+        finally:
+            self._retry_lock.release()
+            self._queue.mutex.release()
+        for callback in pending:
+            self._release(callback)
+
+    def _after_fork_in_child(self):
+        # threads do not survive a fork and inherited locks may be held:
+        # rebuild the state, keeping the parent events only on handoff
+        pending, retries = [], []
+        if self.options['fork_policy'] == 'handoff':
+            pending = [item for lane in self._queue.lanes.values() for item in lane]
+            retries = self._retries
+        self._queue = LaneQueue(self.options['queue_size'], self.options['lanes'], self.lane_of)
+        self._space = threading.Condition()
+        self._retry_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._counts_lock = threading.Lock()
+        self._thread = None
+        self._thread_for_pid = None
+        self.terminating = False
+        self._retries = retries
+        self._queue.unfinished_tasks = len(retries)
+        self._bytes = sum(self._sizeof(callback) for *__, callback in retries)
+        if self.spool is not None:
+            # the spool files belong to the parent
+            logger.warning('spool disabled in forked process')
+            self.spool = None
+        if self.options['overflow'] == 'spill':
+            logger.warning('"spill" overflow policy needs a spool: using "drop_newest" in forked process')
+            self.options['overflow'] = 'drop_newest'
+        self._spilled = deque()
+        metrics.QUEUE_DEPTH.set_function(self._queue.qsize, worker=self.name)
+        for callback in pending:
+            self._queue.put_nowait(callback)
+            self._bytes += self._sizeof(callback)
+        if pending or retries:
+            self.start()
 
     def terminate(self):
         self.terminating = True
 
-    def backoff(self):
-        return int(self.options['backoff'] * self.errors)
+    def backoff(self, attempts):
+        # type: (int) -> float
+        # capped exponential backoff with "equal jitter"
+        delay = min(self.options['max_backoff'], self.options['backoff'] * 2 ** (attempts - 1))
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    @property
+    def retries(self):
+        # type: () -> int
+        return len(self._retries)
+
+    def _retry(self, callback, attempts, exc, delay=None):
+        # type: (Callable[[], None], int, Exception, Optional[float]) -> None
+        if attempts >= self.options['max_attempts']:
+            logger.error(f'Giving up {callback} after {attempts} attempts.')
+            self._dead(callback, exc)
+            return
+        if delay is None:
+            delay = self.backoff(attempts)
+        deadline = getattr(callback, 'deadline', None)
+        if deadline and time() + delay > deadline:
+            logger.error(f'Giving up {callback}: deadline exceeded.')
+            self._dead(callback, DeadlineExceeded('Deadline exceeded'))
+            return
+        logger.error(f'Reschedule due {exc.__class__.__name__} in {delay:.1f}s.')
+        metrics.RETRIED.inc()
+        with self._retry_lock:
+            self._seq += 1
+            heapq.heappush(self._retries, (time() + delay, self._seq, attempts, callback))
+
+    def _retry_throttled(self, callback, attempts, exc):
+        # type: (Callable[[], None], int, RateLimited) -> None
+        # throttled, not failed: wait as long as asked, same attempt, up to `max_throttled` times
+        with self._retry_lock:
+            throttled = self._throttled[id(callback)] = self._throttled.get(id(callback), 0) + 1
+        if throttled > self.options['max_throttled']:
+            logger.error(f'Giving up {callback} after {throttled - 1} throttled attempts.')
+            self._dead(callback, exc)
+            return
+        self._retry(callback, attempts, exc, exc.time_left)
+
+    def _dead(self, callback, exc):
+        # type: (Callable[[], None], Optional[Exception]) -> None
+        metrics.FAILED.inc()
+        self._count(failed=1)
+        try:
+            self._ack(callback)
+            if self.options['dead_letter']:
+                self.options['dead_letter'](callback, exc)
+        except Exception:
+            logger.error("Error in dead_letter hook", exc_info=True)
+        finally:
+            self._done(callback)
+
+    def _abandon_retries(self):
+        # type: () -> None
+        # on shutdown: spooled events are not acked, so they will be replayed
+        with self._retry_lock:
+            retries, self._retries = self._retries, []
+        if retries:
+            logger.warning(f'Abandoning {len(retries)} events waiting for retry')
+        for __, __, __, callback in retries:
+            self._done(callback)
+
+    def _next(self, timeout=None):
+        # type: (Optional[float]) -> tuple
+        # returns (attempts, callback): the first due retry, if any,
+        # otherwise the next queued event. callback is None on timeout.
+        if self._spilled and self._queue.empty():
+            self._refill()
+        with self._retry_lock:
+            if self._retries:
+                due, __, attempts, callback = self._retries[0]
+                wait = due - time()
+                if wait <= 0:
+                    heapq.heappop(self._retries)
+                    return attempts, callback
+                timeout = wait if timeout is None else min(wait, timeout)
+        try:
+            item = self._queue.get(timeout=timeout)
+        except Empty:
+            return 0, None
+        if item is _NUDGE:
+            return 0, None
+        return 0, item
+
+    def _handle(self, callback, attempts=0):
+        # type: (Callable[[], None], int) -> bool
+        metrics.IN_FLIGHT.inc()
+        try:
+            callback()
+        except RateLimited as e:
+            self._retry_throttled(callback, attempts, e)
+            return False
+        except DeadlineExceeded as e:
+            self._dead(callback, e)
+            return False
+        except RETRYABLE as e:
+            self.errors += 1
+            self._retry(callback, attempts + 1, e)
+            return False
+        except Exception as e:
+            self.errors += 1
+            logger.error("Failed processing job", exc_info=True)
+            self._dead(callback, e)
+            return False
+        finally:
+            metrics.IN_FLIGHT.dec()
+        self.errors = 0
+        metrics.SENT.inc()
+        self._count(sent=1)
+        self._ack(callback)
+        self._done(callback)
+        return True
+
+    def _wake_up(self):
+        # type: () -> None
+        self._queue.put_nowait(_TERMINATOR)
 
     def _target(self):
         # type: () -> None
         while not self.terminating:
-            callback = self._queue.get()
+            attempts, callback = self._next()
+            if callback is None:
+                continue
             logger.debug(f'deque {callback}')
+            if callback is _TERMINATOR:
+                logger.debug("Terminator found. Break")
+                self._abandon_retries()
+                self._queue.task_done()
+                break
+            self._handle(callback, attempts)
+            sleep(0)
+        logger.debug("Exiting...")
+
+
+class SenderThread(threading.Thread):
+    def __init__(self, worker, index):
+        super().__init__(name=f'bitcaster_sdk.PooledWorker-{index}', daemon=True)
+        self.worker = worker
+        self.processed = 0
+        self.failures = 0
+        self.errors = 0  # consecutive
+        self.busy_since = None  # type: Optional[float]
+        self.last_activity = None  # type: Optional[float]
+
+    def run(self):
+        # type: () -> None
+        self.worker._sender_loop(self)
+
+    def health(self):
+        # type: () -> dict
+        busy_for = time() - self.busy_since if self.busy_since else 0
+        return {'name': self.name,
+                'alive': self.is_alive(),
+                'processed': self.processed,
+                'failures': self.failures,
+                'consecutive_errors': self.errors,
+                'busy_for': busy_for,
+                'stalled': busy_for > self.worker.options['stall_timeout'],
+                'last_activity': self.last_activity}
+
+
+class PooledWorker(BackgroundWorker):
+    """
+    drains the queue with a pool of sender threads, so one slow request
+    only blocks the thread running it.
+
+    The pool starts with `min_threads` and grows up to `max_threads` while
+    more than `scale_threshold` events per running thread are pending.
+    Threads above the minimum exit after `idle_timeout` seconds without work.
+    """
+
+    def __init__(self, options: dict = None):
+        opts = {'min_threads': 1, 'max_threads': 4, 'scale_threshold': 10,
+                'idle_timeout': 30, 'stall_timeout': 30}
+        if options:
+            opts.update(options)
+        super().__init__(opts)
+        self._threads = []  # type: list
+        self._counter = 0
+
+    @property
+    def is_alive(self):
+        # type: () -> bool
+        if self._thread_for_pid != os.getpid():
+            return False
+        return any(t.is_alive() for t in self._threads)
+
+    @property
+    def size(self):
+        # type: () -> int
+        return len(self._alive_threads())
+
+    def _alive_threads(self):
+        # type: () -> list
+        if self._thread_for_pid != os.getpid():
+            return []
+        return [t for t in self._threads if t.is_alive()]
+
+    def _spawn(self):
+        # type: () -> None
+        self._counter += 1
+        thread = SenderThread(self, self._counter)
+        self._threads.append(thread)
+        thread.start()
+
+    def start(self):
+        # type: () -> None
+        with self._lock:
             try:
-                if callback is _TERMINATOR:
-                    logger.debug("Terminator found. Break")
-                    break
-                bk = self.backoff()
-                sleep(bk)
-                try:
-                    callback()
-                    self.errors = 0
-                except (HTTPError, ConnectionError,):
-                    logger.error('Reschedule due ConnectionError.')
-                    self.errors += 1
-                    self._queue.put_nowait(callback)
-                except Exception:
-                    self.errors += 1
-                    logger.error("Failed processing job", exc_info=True)
+                self._threads = self._alive_threads()
+                self._thread_for_pid = os.getpid()
+                while len(self._threads) < self.options['min_threads']:
+                    self._spawn()
             finally:
+                self._register_atexit()
+
+    def submit(self, callback):
+        # type: (Callable[[], None]) -> None
+        super().submit(callback)
+        self._autoscale()
+
+    def _autoscale(self):
+        # type: () -> None
+        with self._lock:
+            running = len(self._threads)
+            if running >= self.options['max_threads']:
+                return
+            if self._queue.qsize() > self.options['scale_threshold'] * running:
+                logger.debug(f'scaling sender pool to {running + 1}')
+                self._spawn()
+
+    def _wake_up(self):
+        # type: () -> None
+        for __ in self._alive_threads():
+            self._queue.put_nowait(_TERMINATOR)
+
+    def health(self):
+        # type: () -> list
+        return [t.health() for t in list(self._threads)]
+
+    def _sender_loop(self, thread):
+        # type: (SenderThread) -> None
+        while not self.terminating:
+            attempts, callback = self._next(self.options['idle_timeout'])
+            if callback is None:
+                if self.retries:
+                    continue
+                with self._lock:
+                    if len(self._threads) > self.options['min_threads']:
+                        self._threads.remove(thread)
+                        break
+                continue
+            if callback is _TERMINATOR:
+                logger.debug("Terminator found. Break")
+                self._abandon_retries()
+                self._queue.task_done()
+                break
+            thread.busy_since = time()
+            try:
+                if self._handle(callback, attempts):
+                    thread.errors = 0
+                else:
+                    thread.errors += 1
+                    thread.failures += 1
+                thread.processed += 1
+            finally:
+                thread.busy_since = None
+                thread.last_activity = time()
+        logger.debug(f"{thread.name} exiting...")
+
+
+class BatchResult:
+    def __init__(self, items=None):
+        self.items = list(items or [])
+        self.sent = []
+        self.failed = []  # type: list
+
+    def success(self, item):
+        self.sent.append(item)
+
+    def failure(self, item, exc):
+        self.failed.append((item, exc))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return f'<BatchResult sent={len(self.sent)} failed={len(self.failed)}>'
+
+
+def dispatch_sequential(batch):
+    # type: (list) -> BatchResult
+    # callbacks share the same Transport session, so the whole batch
+    # goes over the same keep-alive connection
+    result = BatchResult(batch)
+    for callback in batch:
+        try:
+            callback()
+            result.success(callback)
+        except Exception as e:
+            result.failure(callback, e)
+    return result
+
+
+def _pool_size(batch):
+    # type: (list) -> int
+    # connections the batch can use: the pool of the events' transport
+    for callback in batch:
+        transport = getattr(getattr(callback, 'client', None), 'transport', None)
+        if transport is not None:
+            return transport.options.get('pool_maxsize', 10)
+    return 1
+
+
+def _gather(batch, executor):
+    # type: (list, ThreadPoolExecutor) -> BatchResult
+    result = BatchResult(batch)
+    futures = []
+    for callback in batch:
+        try:
+            futures.append((callback, executor.submit(callback)))
+        except RuntimeError:  # executor shut down, or interpreter exiting: send inline
+            futures.append((callback, None))
+    for callback, future in futures:
+        try:
+            if future is None:
+                callback()
+            else:
+                future.result()
+            result.success(callback)
+        except Exception as e:
+            result.failure(callback, e)
+    return result
+
+
+def dispatch_concurrent(batch, max_workers=None):
+    # type: (list, Optional[int]) -> BatchResult
+    # overlaps the requests of the batch over the connection pool
+    # (`pool_maxsize` connections, unless `max_workers` is given).
+    # BatchWorker runs it on threads kept for its whole life
+    workers = min(len(batch), max_workers or _pool_size(batch))
+    if workers <= 1:
+        return dispatch_sequential(batch)
+    with ThreadPoolExecutor(workers, thread_name_prefix='bitcaster-batch') as executor:
+        return _gather(batch, executor)
+
+
+class BatchWorker(BackgroundWorker):
+    """
+    collects submitted callbacks for up to `batch_size` items or
+    `batch_interval` milliseconds and hands them to `dispatch` as a list.
+
+    `dispatch` must return a BatchResult; `on_batch`, if set, receives it
+    after every batch. The default, `dispatch_concurrent`, sends the batch
+    over the transport connection pool, from sender threads kept until
+    `shutdown()`; `dispatch_sequential` sends one event at a time on a
+    single connection.
+    """
+
+    def __init__(self, options: dict = None):
+        opts = {'batch_size': 50, 'batch_interval': 200,
+                'dispatch': dispatch_concurrent, 'on_batch': None}
+        if options:
+            opts.update(options)
+        super().__init__(opts)
+        self._executor = None  # type: Optional[ThreadPoolExecutor]
+
+    def _dispatch(self, callbacks):
+        # type: (list) -> BatchResult
+        if self.options['dispatch'] is not dispatch_concurrent:
+            return self.options['dispatch'](callbacks)
+        executor = self._executor
+        if executor is None:
+            size = _pool_size(callbacks)
+            if size <= 1:
+                return dispatch_sequential(callbacks)
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(size, thread_name_prefix='bitcaster-batch')
+                executor = self._executor
+        return _gather(callbacks, executor)
+
+    def shutdown(self, timeout=None):
+        # type: (Optional[float]) -> dict
+        result = super().shutdown(timeout)
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        return result
+
+    def _after_fork_in_child(self):
+        # the executor threads stayed in the parent
+        self._executor = None
+        super()._after_fork_in_child()
+
+    def _collect(self, timeout=None):
+        # type: (Optional[float]) -> tuple
+        # returns ([(attempts, callback), ...], terminate)
+        batch = []
+        attempts, first = self._next(timeout)
+        if first is None:
+            return batch, False
+        if first is _TERMINATOR:
+            return batch, True
+        batch.append((attempts, first))
+        deadline = time() + self.options['batch_interval'] / 1000.0
+        while len(batch) < self.options['batch_size']:
+            remaining = deadline - time()
+            if remaining <= 0:
+                break
+            attempts, item = self._next(remaining)
+            if item is None:
+                break
+            if item is _TERMINATOR:
+                return batch, True
+            batch.append((attempts, item))
+        return batch, False
+
+    def _process(self, batch):
+        # type: (list) -> BatchResult
+        callbacks = [callback for __, callback in batch]
+        attempts = {id(callback): n for n, callback in batch}
+        metrics.IN_FLIGHT.inc(len(callbacks))
+        try:
+            result = self._dispatch(callbacks)
+        except Exception as e:
+            logger.error("Failed processing batch", exc_info=True)
+            result = BatchResult(callbacks)
+            for callback in callbacks:
+                result.failure(callback, e)
+        finally:
+            metrics.IN_FLIGHT.dec(len(callbacks))
+        metrics.SENT.inc(len(result.sent))
+        self._count(sent=len(result.sent))
+
+        if result.failed:
+            self.errors += 1
+        else:
+            self.errors = 0
+
+        for callback in result.sent:
+            self._ack(callback)
+            self._done(callback)
+        for callback, exc in result.failed:
+            if isinstance(exc, RateLimited):
+                self._retry_throttled(callback, attempts[id(callback)], exc)
+            elif isinstance(exc, RETRYABLE) and not isinstance(exc, DeadlineExceeded):
+                self._retry(callback, attempts[id(callback)] + 1, exc)
+            else:
+                self._dead(callback, exc)
+        if self.options['on_batch']:
+            try:
+                self.options['on_batch'](result)
+            except Exception:
+                logger.error("Error in on_batch hook", exc_info=True)
+        return result
+
+    def _drain_step(self, timeout):
+        # type: (float) -> bool
+        batch, terminate = self._collect(timeout)
+        if batch:
+            self._process(batch)
+        if terminate:
+            self._queue.task_done()
+            self._queue.put(_TERMINATOR)
+            return False
+        return True
+
+    def _target(self):
+        # type: () -> None
+        while not self.terminating:
+            batch, terminate = self._collect()
+            if batch:
+                logger.debug(f'deque batch of {len(batch)}')
+                self._process(batch)
+            if terminate:
+                logger.debug("Terminator found. Break")
+                self._abandon_retries()
                 self._queue.task_done()
+                break
             sleep(0)
         logger.debug("Exiting...")
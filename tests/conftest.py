@@ -1,4 +1,7 @@
+import json
 import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 import pytest
 import responses
@@ -75,6 +78,23 @@ def sdk_setup():
         yield rsps, sdk
 
 
+@pytest.fixture(scope='function')
+def org_setup():
+    # like sdk_setup, with a fixed organization endpoint whatever BITCASTER_SDT is
+    sdk = Bitcaster("http://sdk-xxxxxxxxx@localhost:8000/api/o/bitcaster/")
+
+    with responses.RequestsMock() as rsps:
+        payload = {
+            "base_api": "http://localhost:8000/api/",
+            "slug": "bitcaster",
+            "org": "Bitcaster",
+            }
+        rsps.add(rsps.GET, 'http://localhost:8000/api/system/ping/',
+                 json=payload,
+                 status=200)
+        yield rsps, sdk
+
+
 @pytest.fixture(scope='function')
 def client_setup():
     # yield FakeRequestsMock()
@@ -85,3 +105,38 @@ def client_setup():
 
     with responses.RequestsMock() as rsps:
         yield rsps, client
+
+
+class LocalHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.body = self.rfile.read(length) if length else b''
+        self.server.received.append((self.command, self.path, dict(self.headers), body))
+        status, payload = self.server.reply(self)
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='function')
+def local_server():
+    # real socket server, for tests that need actual connections
+    server = ThreadingHTTPServer(('127.0.0.1', 0), LocalHandler)
+    server.received = []
+    server.reply = lambda handler: (201, {"message": "Event triggered"})
+    t = threading.Thread(target=server.serve_forever, daemon=True)
+    t.start()
+    server.url = 'http://127.0.0.1:%s' % server.server_address[1]
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,129 @@
+import asyncio
+import os
+
+import pytest
+
+from bitcaster_sdk.aio import AsyncClient
+
+pytest.importorskip('aiohttp')
+
+
+def test_send(local_server):
+    async def run():
+        client = AsyncClient(f'http://key-123@{local_server.url[7:]}/api/o/bitcaster/a/38/')
+        res = await client.send(26, {'a': 1})
+        await client.close()
+        return res
+
+    res = asyncio.run(run())
+    assert res.status_code == 201
+    method, path, headers, body = local_server.received[0]
+    assert path == '/api/o/bitcaster/a/38/s/26/trigger/'
+    assert headers['Authorization'] == 'Key key-123'
+
+
+def test_queue_and_flush(local_server):
+    async def run():
+        client = AsyncClient(f'http://key-123@{local_server.url[7:]}/api/o/bitcaster/a/38/',
+                             concurrency=4)
+        for i in range(10):
+            client.queue(26, {'i': i})
+        assert not client.empty()
+        assert await client.flush(5)
+        assert client.empty()
+        await client.close()
+
+    asyncio.run(run())
+    assert len(local_server.received) == 10
+
+
+def test_bitcaster_gather(local_server):
+    from bitcaster_sdk.aio import AsyncBitcaster
+
+    def reply(handler):
+        if handler.path == '/api/system/ping/':
+            return 200, {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'}
+        return 200, [{'path': handler.path}]
+
+    local_server.reply = reply
+
+    async def run():
+        sdk = AsyncBitcaster(f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/', concurrency=4)
+        ret = await sdk.map(sdk.get_assignments, range(10))
+        members = await sdk.get_members()
+        await sdk.close()
+        return ret, members
+
+    ret, members = asyncio.run(run())
+    assert [r[0]['path'] for r in ret] == [f'/api/o/bitcaster/m/{i}/aa/' for i in range(10)]
+    assert members.status_code == 200
+    pings = [r for r in local_server.received if r[1] == '/api/system/ping/']
+    assert len(pings) == 1
+
+
+def test_bitcaster_paginate(local_server):
+    from bitcaster_sdk.aio import AsyncBitcaster
+
+    def reply(handler):
+        if handler.path == '/api/system/ping/':
+            return 200, {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'}
+        if 'page=2' in handler.path:
+            return 200, {'results': [{'id': 2}], 'next': None}
+        return 200, {'results': [{'id': 1}], 'next': f'{local_server.url}/api/o/bitcaster/m/?page=2'}
+
+    local_server.reply = reply
+
+    async def run():
+        sdk = AsyncBitcaster(f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/')
+        ret = [m['id'] async for m in sdk.iter_members()]
+        await sdk.close()
+        return ret
+
+    assert asyncio.run(run()) == [1, 2]
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires os.register_at_fork')
+def test_bitcaster_fork(local_server):
+    from bitcaster_sdk.aio import AsyncBitcaster
+
+    def reply(handler):
+        if handler.path == '/api/system/ping/':
+            return 200, {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'}
+        return 200, [{'id': 1}]
+
+    local_server.reply = reply
+    sdk = AsyncBitcaster(f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/')
+
+    async def run():
+        await sdk.init()
+        return (await sdk.get_members()).json()
+
+    loop = asyncio.new_event_loop()
+    assert loop.run_until_complete(run()) == [{'id': 1}]
+    pid = os.fork()
+    if pid == 0:
+        ok = sdk.session is None and sdk._init_lock is None
+        try:
+            os._exit(0 if ok and asyncio.run(run()) == [{'id': 1}] else 1)
+        except BaseException:
+            os._exit(2)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert sdk.session is not None
+    loop.run_until_complete(sdk.close())
+    loop.close()
+
+
+def test_bitcaster_import_members():
+    from bitcaster_sdk.aio import AsyncBitcaster
+
+    sdk = AsyncBitcaster('http://sdk-123@localhost:8000/api/o/bitcaster/')
+    with pytest.raises(NotImplementedError):
+        sdk.import_members([{'email': 'a@example.com'}])
+
+
+def test_bitcaster_stream_resolver():
+    from bitcaster_sdk.aio import AsyncBitcaster
+
+    sdk = AsyncBitcaster('http://sdk-123@localhost:8000/api/o/bitcaster/')
+    with pytest.raises(NotImplementedError):
+        sdk.stream_resolver(38)
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.run import RemoteServer, run  # noqa: E402
+from benchmarks.server import StandInServer  # noqa: E402
+
+
+@pytest.fixture
+def stand_in():
+    server = StandInServer(retry_after=0.01).start()
+    yield server
+    server.stop()
+
+
+def test_benchmark_run(stand_in):
+    server = RemoteServer(stand_in.url)
+    results = run(server, ['sync'], ['default', 'gzip'], 20, admin_calls=5)
+    # SynchronousWorker raises on 429: inject them only where the worker retries
+    stand_in.throttle_rate = 0.1
+    results += run(server, ['background'], ['default', 'gzip'], 20)
+    triggers = [r for r in results if r['kind'] == 'trigger']
+    assert len(triggers) == 4
+    for result in triggers:
+        assert result['delivered'] + result['errors'] + result['failed'] == 20
+        assert result['enqueue_ms']['p99'] is not None
+        assert result['cpu_ms_per_send'] > 0
+    assert [r for r in triggers if r['worker'] == 'background'][0]['memory_bytes_per_event'] > 0
+    assert {r['call'] for r in results if r['kind'] == 'admin'} == {'ping', 'get_members', 'filter_streams'}
@@ -0,0 +1,61 @@
+from bitcaster_sdk.cache import ResponseCache
+
+BASE = 'http://localhost:8000/api/o/bitcaster/'
+
+
+def test_read_through(org_setup):
+    responses, client = org_setup
+    client.cache = ResponseCache()
+    responses.add(responses.GET, f'{BASE}c/', json=[{'id': 1}], status=200)
+    assert client.get_channels() == client.get_channels() == [{'id': 1}]
+    assert len([c for c in responses.calls if '/c/' in c.request.url]) == 1
+    assert client.cache.hits == 1
+
+
+def test_revalidate(org_setup):
+    responses, client = org_setup
+    client.cache = ResponseCache(ttl=0)
+    responses.add(responses.GET, f'{BASE}a/1/', json={'id': 1}, status=200, headers={'ETag': '"v1"'})
+    responses.add(responses.GET, f'{BASE}a/1/', status=304)
+    assert client.get_application(1).json() == {'id': 1}
+    assert client.get_application(1).json() == {'id': 1}
+    assert responses.calls[-1].request.headers['If-None-Match'] == '"v1"'
+    assert client.cache.revalidated == 1
+
+
+def test_invalidate_on_update(org_setup):
+    responses, client = org_setup
+    client.cache = ResponseCache(ttls={'c/': None})
+    responses.add(responses.GET, f'{BASE}a/1/s/', json=[{'id': 2, 'name': 'a'}], status=200)
+    responses.add(responses.GET, f'{BASE}a/1/', json={'id': 1}, status=200)
+    responses.add(responses.PATCH, f'{BASE}a/1/s/2/', json={'id': 2, 'name': 'b'}, status=200)
+    client.filter_streams(1)
+    client.get_application(1)
+    assert len(client.cache) == 2
+    client.update_stream(1, 2, name='b')
+    assert len(client.cache) == 0
+
+
+def test_validate_not_cached(org_setup):
+    # validating an OTP consumes it: never replay the response
+    responses, client = org_setup
+    client.cache = ResponseCache(ttl=600)
+    client.init()
+    responses.add(responses.GET, f'{client.host}/validate/', json={'valid': True}, status=200)
+    client.validate_remote_address('123456')
+    client.validate_remote_address('123456')
+    assert len([c for c in responses.calls if '/validate/' in c.request.url]) == 2
+    assert len(client.cache) == 0
+
+
+def test_lru():
+    class Response:
+        status_code = 200
+        headers = {}
+
+    cache = ResponseCache(maxsize=2, ttls={'c/': None})
+    for url in ('a/1/', 'a/2/', 'a/3/', 'c/'):
+        cache.process('get', BASE + url, Response())
+    assert cache.get(BASE + 'a/1/') is None
+    assert cache.get(BASE + 'a/3/') is not None
+    assert cache.get(BASE + 'c/') is None
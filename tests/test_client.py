@@ -58,3 +58,93 @@ def test_queue(client_setup):
     client.queue(stream=26, context={'a': 2})
     while not client.empty():
         sleep(1)
+
+
+def test_idempotency_key_on_retry(local_server):
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    replies = [(429, {'time_left': 0.05}), (201, {})]
+    local_server.reply = lambda handler: replies.pop(0)
+    worker = BackgroundWorker()
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker)
+    client.queue(26, {'a': 1})
+    for _ in range(50):
+        if len(local_server.received) == 2:
+            break
+        sleep(.1)
+    client.terminate()
+    keys = {r[2]['Idempotency-Key'] for r in local_server.received}
+    assert len(local_server.received) == 2
+    assert len(keys) == 1
+
+
+def test_coalesce(local_server):
+    import threading
+
+    from bitcaster_sdk.client import Coalescer, Event
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    def block():
+        # keeps the worker thread busy while events are queued
+        release, started = threading.Event(), threading.Event()
+        worker.submit(lambda: started.set() or release.wait(5))
+        started.wait(5)
+        return release
+
+    worker = BackgroundWorker()
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker,
+                    coalesce_window=60)
+    release = block()
+    for __ in range(5):
+        client.queue(26, {'error': 'same'})
+    client.queue(26, {'error': 'other'})
+    release.set()
+    assert client.flush(5)['pending'] == 0
+    assert sorted(r[2].get('X-Coalesced-Count', '1') for r in local_server.received) == ['1', '5']
+    # the group is closed once dispatched: later duplicates are sent again
+    release = block()
+    for __ in range(3):
+        client.queue(26, {'error': 'same'})
+    release.set()
+    assert client.flush(5)['pending'] == 0
+    assert local_server.received[-1][2]['X-Coalesced-Count'] == '3'
+    assert len(local_server.received) == 3
+    client.terminate()
+
+    coalescer = Coalescer(60)
+    first, second = Event(client, 26, {}), Event(client, 26, {})
+    assert coalescer.coalesce((26, 'hash'), first) is None
+    assert coalescer.coalesce((26, 'hash'), second) is first
+    assert first.count == 2
+    assert first.headers()['X-Coalesced-Count'] == '2'
+    coalescer.dispatch(first)
+    assert coalescer.coalesce((26, 'hash'), second) is None
+
+
+def test_coalesce_after_failure(local_server):
+    replies = [(500, {})]
+    local_server.reply = lambda handler: replies.pop(0) if replies else (201, {})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', coalesce_window=60)
+    with pytest.raises(Exception):
+        client.queue(26, {'error': 'same'})
+    for __ in range(4):
+        client.queue(26, {'error': 'same'})
+    # SynchronousWorker: every event is dispatched at once, nothing is merged
+    assert len(local_server.received) == 5
+
+
+def test_flush_and_terminate(local_server):
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    worker = BackgroundWorker()
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker)
+    for i in range(5):
+        client.queue(26, {'n': i})
+    # the worker thread may send some before flush() starts: those are not counted by flush()
+    result = client.flush(5)
+    assert (result['failed'], result['pending']) == (0, 0)
+    assert worker.sent == len(local_server.received) == 5
+    client.queue(26, {'n': 5})
+    result = client.terminate(5)
+    assert (result['failed'], result['abandoned']) == (0, 0)
+    assert worker.sent == len(local_server.received) == 6
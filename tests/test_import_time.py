@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+import bitcaster_sdk
+
+# seconds, best of 5 runs of `import bitcaster_sdk` in a fresh interpreter
+BUDGET = float(os.environ.get('BITCASTER_IMPORT_BUDGET', 0.05))
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import bitcaster_sdk
+from bitcaster_sdk import trigger
+elapsed = time.perf_counter() - start
+heavy = [m for m in ('requests', 'urllib3', 'humanfriendly', 'bitcaster_sdk.transport') if m in sys.modules]
+print(elapsed, ','.join(heavy))
+'''
+
+
+def _run():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT], env=env, text=True)
+    elapsed, heavy = out.split(' ')
+    return float(elapsed), heavy.strip()
+
+
+def test_import_is_light():
+    assert _run()[1] == ''
+
+
+def test_import_time_budget():
+    best = min(_run()[0] for _ in range(5))
+    assert best < BUDGET, f'import bitcaster_sdk took {best * 1000:.1f}ms (budget {BUDGET * 1000:.0f}ms)'
+
+
+def test_lazy_submodules():
+    assert bitcaster_sdk.metrics.registry is not None
+    assert not hasattr(bitcaster_sdk, 'missing')
@@ -0,0 +1,59 @@
+import csv
+import io
+import json
+from itertools import count
+
+from bitcaster_sdk.importer import Importer, main, read_csv
+from bitcaster_sdk.sdk import Bitcaster
+
+ROWS = '''email,name,role,address,channel,verify
+a@example.com,a,member,a@example.com,systememail,1
+bad@example.com,b,member,,,
+c@example.com,c,member,,,
+'''
+
+
+def server_reply():
+    ids = count(1)
+
+    def reply(handler):
+        if handler.path == '/api/system/ping/':
+            return 200, {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'}
+        if b'bad@' in handler.body:
+            return 400, {'email': ['invalid']}
+        return 201, {'id': next(ids)}
+
+    return reply
+
+
+def test_import(local_server, tmp_path):
+    local_server.reply = server_reply()
+    sdk = Bitcaster(f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/')
+    checkpoint, report = str(tmp_path / 'ckpt'), str(tmp_path / 'report.csv')
+    progress = []
+    importer = Importer(sdk, concurrency=2, chunk_size=2, checkpoint=checkpoint, report=report,
+                        progress=lambda *args: progress.append(args))
+
+    summary = importer.run(read_csv(io.StringIO(ROWS)))
+    assert summary == {'rows': 3, 'skipped': 0, 'imported': 2, 'failed': 1}
+    assert progress == [(2, 1), (3, 1)]
+    with open(report) as f:
+        results = list(csv.DictReader(f))
+    assert [r['status'] for r in results] == ['ok', 'failed', 'ok']
+    assert results[0]['assignment'] and not results[2]['address']
+    assert 'add_member: Error 400' in results[1]['error']
+    paths = [r[1] for r in local_server.received if r[0] == 'POST']
+    assert paths.count('/api/o/bitcaster/m/') == 3
+    assert any(p.endswith('/verify/') for p in paths)
+
+    # resume
+    assert importer.run(read_csv(io.StringIO(ROWS)))['skipped'] == 3
+
+
+def test_cli(local_server, tmp_path, capsys):
+    local_server.reply = server_reply()
+    source = tmp_path / 'members.ndjson'
+    source.write_text('{"email": "a@example.com", "name": "a"}\n\n{"email": "b@example.com", "name": "b"}\n')
+    ret = main([str(source), '--sdt', f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/'])
+    assert ret == 0
+    assert json.loads(capsys.readouterr().out) == {'rows': 2, 'skipped': 0, 'imported': 2, 'failed': 0}
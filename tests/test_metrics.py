@@ -0,0 +1,84 @@
+import pytest
+
+from bitcaster_sdk import metrics
+from bitcaster_sdk.metrics import Registry
+
+
+@pytest.fixture()
+def enabled():
+    metrics.registry.reset()
+    metrics.enable()
+    yield metrics.registry
+    metrics.disable()
+    metrics.registry.reset()
+
+
+def test_disabled_registry_records_nothing():
+    registry = Registry()
+    counter = registry.counter('c', 'doc')
+    counter.inc()
+    assert registry.snapshot() == {'c': 0}
+
+
+def test_prometheus_format():
+    registry = Registry(enabled=True)
+    registry.counter('events_total', 'Events.', ('reason',)).inc(reason='oldest')
+    h = registry.histogram('latency_seconds', 'Latency.', buckets=(0.1, 1))
+    h.observe(0.05)
+    h.observe(0.5)
+    assert registry.to_prometheus() == '\n'.join([
+        '# HELP events_total Events.',
+        '# TYPE events_total counter',
+        'events_total{reason="oldest"} 1',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 2',
+        'latency_seconds_sum 0.55',
+        'latency_seconds_count 2',
+    ]) + '\n'
+
+
+def test_client_send_metrics(enabled, client_setup):
+    responses, client = client_setup
+    responses.add(responses.POST, 'http://localhost:8000/api/o/bitcaster/a/38/s/26/trigger/',
+                  json={}, status=201)
+    client.send(26, {})
+    snapshot = enabled.snapshot()
+    assert snapshot['bitcaster_send_duration_seconds']['stream=26,status=201']['count'] == 1
+
+
+def test_worker_metrics(enabled):
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    worker = BackgroundWorker()
+    for __ in range(3):
+        worker.submit(lambda: None)
+    assert worker._timed_queue_join(2)
+    snapshot = enabled.snapshot()
+    assert snapshot['bitcaster_events_enqueued_total'] == 3
+    assert snapshot['bitcaster_events_sent_total'] == 3
+    assert snapshot['bitcaster_sends_in_flight'] == 0
+    worker.terminate()
+
+
+def test_queue_depth_per_worker(enabled):
+    import gc
+    import threading
+
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    release = threading.Event()
+    busy = BackgroundWorker({'name': 'busy'})
+    busy.submit(lambda: release.wait(5))
+    busy.submit(lambda: None)
+    idle = BackgroundWorker({'name': 'idle'})
+    depth = enabled.snapshot()['bitcaster_queue_depth']
+    assert depth['worker=idle'] == 0
+    assert depth['worker=busy'] in (1, 2)
+    del idle
+    gc.collect()
+    assert 'worker=idle' not in enabled.snapshot()['bitcaster_queue_depth']
+    release.set()
+    busy.terminate()
@@ -0,0 +1,57 @@
+import threading
+from time import monotonic
+
+import pytest
+
+from bitcaster_sdk.exceptions import RateLimited
+from bitcaster_sdk.ratelimit import RateLimiter, TokenBucket
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == 0
+    assert 0 < bucket.reserve() <= 0.1
+
+
+def test_stream_limit_does_not_consume_application_tokens():
+    limiter = RateLimiter(rate=100, burst=2, stream_rate=1, stream_burst=1)
+    limiter.acquire(1)
+    with pytest.raises(RateLimited) as e:
+        limiter.acquire(1)
+    assert 0 < e.value.time_left <= 1
+    limiter.acquire(2)
+
+
+def test_pause():
+    limiter = RateLimiter()
+    limiter.acquire()
+    limiter.pause(0.2)
+    start = monotonic()
+    limiter.acquire(block=True)
+    assert monotonic() - start >= 0.15
+
+
+def test_429_reschedules(local_server):
+    from bitcaster_sdk.client import Client
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    replies = [(429, {'time_left': 0.3}), (201, {})]
+    done = threading.Event()
+
+    def reply(handler):
+        ret = replies.pop(0)
+        if not replies:
+            done.set()
+        return ret
+
+    local_server.reply = reply
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/',
+                    worker=BackgroundWorker())
+    start = monotonic()
+    client.queue(26, {})
+    assert done.wait(5)
+    assert client.transport.thread._timed_queue_join(2)
+    assert monotonic() - start >= 0.3
+    assert len(local_server.received) == 2
+    client.terminate()
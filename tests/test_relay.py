@@ -0,0 +1,88 @@
+import io
+import os
+import threading
+
+import pytest
+
+from bitcaster_sdk.client import Client
+from bitcaster_sdk.relay import PREFIX, RelayServer, RelayWorker, encode_frame, read_frame
+from bitcaster_sdk.worker import AbstractWorker, BatchWorker
+
+
+def test_frame():
+    data = encode_frame({'stream': 1}, b'{"a": 1}') * 2
+    stream = io.BytesIO(data)
+    assert read_frame(stream) == ({'stream': 1}, b'{"a": 1}')
+    assert read_frame(stream) == ({'stream': 1}, b'{"a": 1}')
+    assert read_frame(stream) is None
+    frame = encode_frame({'stream': 1}, b'{"a": 1}')
+    for size in (len(frame) - 4, PREFIX.size + 5):
+        with pytest.raises(ValueError):
+            read_frame(io.BytesIO(frame[:size]))
+
+
+def test_relay(local_server, tmp_path):
+    path = str(tmp_path / 'relay.sock')
+    worker = BatchWorker({'batch_interval': 20})
+    relay_client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker)
+    server = RelayServer(path, relay_client)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    clients = [Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=RelayWorker(path))
+               for __ in range(3)]
+    for i, client in enumerate(clients):
+        client.queue(26, {'process': i})
+    for __ in range(100):
+        if len(local_server.received) == 3:
+            break
+        threading.Event().wait(.05)
+    server.shutdown()
+    server.server_close()
+    worker.terminate()
+
+    assert sorted(r[3] for r in local_server.received) == [b'{"process": %d}' % i for i in range(3)]
+    assert all(r[2]['Idempotency-Key'] for r in local_server.received)
+    assert all(r[1] == '/api/o/bitcaster/a/38/s/26/trigger/' for r in local_server.received)
+
+
+class ListWorker(AbstractWorker):
+    def __init__(self):
+        super().__init__()
+        self.submitted = []
+
+    def submit(self, callback):
+        self.submitted.append(callback)
+
+
+def test_relay_unavailable(tmp_path):
+    client = Client('http://key-1@localhost:8000/api/o/bitcaster/a/38/',
+                    worker=RelayWorker(str(tmp_path / 'missing.sock')))
+    client.queue(26, {})
+    assert client.transport.thread.dropped == 1
+
+    fallback = ListWorker()
+    client.transport.thread = RelayWorker(str(tmp_path / 'missing.sock'), fallback=fallback)
+    client.queue(26, {})
+    assert len(fallback.submitted) == 1
+
+
+def test_remove_stale_socket(tmp_path):
+    import socket
+
+    from bitcaster_sdk.exceptions import ConfigurationError
+
+    path = tmp_path / 'not-a-socket'
+    path.write_text('keep me')
+    with pytest.raises(ConfigurationError):
+        RelayServer.remove_stale(str(path))
+    assert path.read_text() == 'keep me'
+
+    path = str(tmp_path / 'relay.sock')
+    live = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    live.bind(path)
+    live.listen(1)
+    with pytest.raises(ConfigurationError):
+        RelayServer.remove_stale(path)
+    live.close()  # the socket file is left behind, as after a crash
+    RelayServer.remove_stale(path)
+    assert not os.path.exists(path)
@@ -124,3 +124,109 @@ def test_create_assignment(sdk_setup):
                          status=201)
     res = client.create_assignment(1, address=11, channel='systememail')
     assert res.status_code == 201, res.json()
+
+
+def test_deadline(org_setup):
+    from time import sleep
+
+    from bitcaster_sdk.exceptions import DeadlineExceeded
+
+    responses, client = org_setup
+    responses.add(responses.GET, 'http://localhost:8000/api/o/bitcaster/a/',
+                  json=[], status=200)
+    with client.deadline(0.1):
+        client.filter_applications()
+        sleep(0.2)
+        with pytest.raises(DeadlineExceeded):
+            client.filter_applications()
+    assert client.filter_applications().status_code == 200
+
+
+def test_call_log(org_setup):
+    responses, client = org_setup
+    client.calls = type(client.calls)(size=2)
+    for pk in (1, 2, 3):
+        responses.add(responses.GET, f'http://localhost:8000/api/o/bitcaster/m/{pk}/',
+                      json={'id': pk}, status=200)
+        client.get_member(pk)
+    assert len(client.calls) == 2
+    assert client.calls.total == 3
+    stats = client.calls.stats()
+    assert list(stats) == ['GET /api/o/bitcaster/m/{id}/']
+    assert stats['GET /api/o/bitcaster/m/{id}/']['count'] == 2
+    assert stats['GET /api/o/bitcaster/m/{id}/']['bytes'] == 2 * len('{"id": 1}')
+
+
+def test_iter_members(org_setup):
+    responses, client = org_setup
+    url = 'http://localhost:8000/api/o/bitcaster/m/'
+    responses.add(responses.GET, f'{url}?role=admin&page_size=2',
+                  json={'results': [{'id': 1}, {'id': 2}], 'next': f'{url}?page=2'}, status=200,
+                  match_querystring=True)
+    responses.add(responses.GET, f'{url}?page=2',
+                  json={'results': [{'id': 3}], 'next': None}, status=200,
+                  match_querystring=True)
+    assert [m['id'] for m in client.iter_members(page_size=2, role='admin')] == [1, 2, 3]
+    # lazy: stopping on the first page never requests the next one
+    requested = len(responses.calls)
+    members = client.iter_members(page_size=2, role='admin', prefetch=False)
+    assert next(members)['id'] == 1
+    members.close()
+    assert len(responses.calls) == requested + 1
+    assert 'page=2' not in responses.calls[-1].request.url
+
+
+def test_iter_not_paginated(org_setup):
+    responses, client = org_setup
+    responses.add(responses.GET, 'http://localhost:8000/api/o/bitcaster/a/',
+                  json=[{'id': 1}], status=200)
+    assert list(client.iter_applications(prefetch=False)) == [{'id': 1}]
+
+
+def test_init_single_flight(local_server):
+    import threading
+
+    local_server.reply = lambda h: (200, {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'})
+    client = Bitcaster(f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/')
+    threads = [threading.Thread(target=client.get_url, args=('m/',)) for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(local_server.received) == 1
+
+
+def test_init_discovery_cache(local_server, tmp_path):
+    local_server.reply = lambda h: (200, {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'})
+    sdt = f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/'
+    cache = str(tmp_path / 'discovery.json')
+    Bitcaster(sdt, discovery_cache=cache).init()
+    client = Bitcaster(sdt, discovery_cache=cache)
+    client.init()
+    assert client.slug == 'bitcaster'
+    assert len(local_server.received) == 1
+    Bitcaster(sdt, discovery_cache=cache, discovery_ttl=-1).init()
+    assert len(local_server.received) == 2
+
+
+def test_iter_prefetch_deadline(local_server):
+    from time import sleep, time
+
+    from bitcaster_sdk.exceptions import DeadlineExceeded, RequestTimeout
+
+    def reply(handler):
+        if handler.path.startswith('/api/system/ping/'):
+            return 200, {'base_api': '', 'slug': 'bitcaster', 'org': 'Bitcaster'}
+        if 'page=2' in handler.path:
+            sleep(1)
+            return 200, {'results': [{'id': 2}], 'next': None}
+        return 200, {'results': [{'id': 1}], 'next': f'{local_server.url}/api/o/bitcaster/m/?page=2'}
+
+    local_server.reply = reply
+    client = Bitcaster(f'http://sdk-123@{local_server.url[7:]}/api/o/bitcaster/')
+    client.init()
+    start = time()
+    with pytest.raises((DeadlineExceeded, RequestTimeout)):
+        with client.deadline(0.3):
+            list(client.iter_members())
+    assert time() - start < 0.9
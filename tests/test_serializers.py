@@ -0,0 +1,44 @@
+import gzip
+import json
+
+import pytest
+
+from bitcaster_sdk.client import Client
+from bitcaster_sdk.exceptions import ConfigurationError
+from bitcaster_sdk.serializers import JSONSerializer, encode, get_serializer
+
+
+def test_encode():
+    payload = encode({'a': 1}, JSONSerializer())
+    assert payload.body == b'{"a": 1}'
+    assert payload.headers == {'Content-Type': 'application/json'}
+    assert encode(payload, None) is payload
+
+
+def test_compress():
+    payload = encode({'a': 'x' * 1000}, JSONSerializer(), compress_threshold=100)
+    assert payload.headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(payload.body)) == {'a': 'x' * 1000}
+
+
+def test_get_serializer():
+    assert isinstance(get_serializer(), JSONSerializer)
+    assert get_serializer('orjson').dumps({'a': 1}) == b'{"a":1}'
+    with pytest.raises(ConfigurationError):
+        get_serializer('xml')
+
+
+def test_snapshot_at_enqueue(local_server):
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    worker = BackgroundWorker()
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker,
+                    serializer='orjson', compress_threshold=10)
+    context = {'value': 'original'}
+    client.queue(1, context)
+    context['value'] = 'changed'
+    assert worker._timed_queue_join(5)
+    client.terminate()
+    __, __, headers, body = local_server.received[0]
+    assert headers['Content-Encoding'] == 'gzip'
+    assert json.loads(gzip.decompress(body)) == {'value': 'original'}
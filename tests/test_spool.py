@@ -0,0 +1,84 @@
+import os
+
+from bitcaster_sdk.spool import Spool
+
+
+def test_append_ack_replay(tmp_path):
+    spool = Spool(str(tmp_path))
+    ids = [spool.append({'stream': 1, 'context': {'i': i}}) for i in range(3)]
+    spool.ack(ids[1])
+    spool.close()
+
+    spool = Spool(str(tmp_path))
+    assert [r['context']['i'] for r in spool.pending()] == [0, 2]
+    assert spool.append({'stream': 1, 'context': {}}) == 4
+
+
+def test_rotation_and_compaction(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=200)
+    ids = [spool.append({'stream': 1, 'context': {'i': i}}) for i in range(10)]
+    assert len([f for f in os.listdir(tmp_path) if f.endswith('.log')]) > 1
+    for record_id in ids[:-1]:
+        spool.ack(record_id)
+    assert len([f for f in os.listdir(tmp_path) if f.endswith('.log')]) == 1
+    assert len(spool) == 1
+
+
+def test_disk_budget(tmp_path):
+    spool = Spool(str(tmp_path), segment_size=100, max_bytes=300)
+    for i in range(20):
+        spool.append({'stream': 1, 'context': {'i': i}})
+    assert spool.size <= 300
+    assert spool.dropped > 0
+    assert len(spool) + spool.dropped == 20
+
+
+def test_client_replay(tmp_path, local_server):
+    from time import sleep
+
+    from bitcaster_sdk.client import Client
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    spool = Spool(str(tmp_path))
+    spool.append({'stream': 26, 'context': {'a': 1}})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/',
+                    worker=BackgroundWorker({'spool': spool}))
+    for __ in range(50):
+        if not len(spool):
+            break
+        sleep(0.1)
+    assert local_server.received[0][1] == '/api/o/bitcaster/a/38/s/26/trigger/'
+    assert len(spool) == 0
+
+    client.queue(26, {'a': 2})
+    for __ in range(50):
+        if len(local_server.received) == 2:
+            break
+        sleep(0.1)
+    assert local_server.received[1][3] == b'{"a": 2}'
+    client.terminate()
+
+
+def test_replay_encoded_payload(tmp_path, local_server):
+    # relayed events have no context: the encoded body is spooled as is
+    from time import sleep
+
+    from bitcaster_sdk.client import Client, Event
+    from bitcaster_sdk.worker import BackgroundWorker
+
+    url = f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/'
+    sender = Client(url, compress_threshold=0)
+    event = Event(sender, 26, None)
+    event.payload = sender.transport.encode({'a': 1})
+    spool = Spool(str(tmp_path))
+    spool.append(event.serialize())
+    client = Client(url, worker=BackgroundWorker({'spool': spool}))
+    for __ in range(50):
+        if not len(spool):
+            break
+        sleep(0.1)
+    method, path, headers, body = local_server.received[0]
+    assert body == event.payload.body
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Idempotency-Key'] == event.key
+    client.terminate()
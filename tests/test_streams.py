@@ -0,0 +1,119 @@
+import asyncio
+import threading
+from time import sleep
+
+import pytest
+
+from bitcaster_sdk.client import Client
+from bitcaster_sdk.exceptions import StreamNotFound
+from bitcaster_sdk.streams import StreamResolver
+
+STREAMS = [{'id': 1, 'slug': 'user-created', 'name': 'User Created'},
+           {'id': 2, 'slug': 'user-deleted', 'name': 'User Deleted'}]
+
+
+def test_resolve():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return STREAMS
+
+    resolver = StreamResolver(fetch)
+    assert resolver.resolve(7) == resolver.resolve('7') == 7
+    assert not calls
+    assert resolver.resolve('user-created') == 1
+    assert resolver.resolve('User Deleted') == 2
+    assert len(calls) == 1
+    with pytest.raises(StreamNotFound):
+        resolver.resolve('unknown')
+    # recently refreshed, no new lookup
+    assert len(calls) == 1
+
+
+def test_single_flight():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        sleep(.1)
+        return STREAMS
+
+    resolver = StreamResolver(fetch)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(resolver.resolve('user-deleted')))
+               for _ in range(10)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results == [2] * 10
+    assert len(calls) == 1
+
+
+def test_background_refresh():
+    data = [[STREAMS[0]], STREAMS]
+    resolver = StreamResolver(lambda: data.pop(0) if len(data) > 1 else data[0], refresh_interval=.05)
+    resolver.start()
+    sleep(.2)
+    resolver.stop()
+    assert resolver.lookup('user-deleted') == 2
+
+
+def test_client_trigger_by_slug(local_server):
+    local_server.reply = lambda h: (200, STREAMS) if h.command == 'GET' else (201, {})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/')
+    client.send('user-deleted', {})
+    client.send('user-created', {})
+    assert [r[:2] for r in local_server.received] == [
+        ('GET', '/api/o/bitcaster/a/38/s/'),
+        ('POST', '/api/o/bitcaster/a/38/s/2/trigger/'),
+        ('POST', '/api/o/bitcaster/a/38/s/1/trigger/')]
+
+
+def test_async_client_trigger_by_slug(local_server):
+    from bitcaster_sdk.aio import AsyncClient
+
+    local_server.reply = lambda h: (200, {'results': STREAMS}) if h.command == 'GET' else (201, {})
+
+    async def run():
+        client = AsyncClient(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/')
+        await asyncio.gather(*(client.send('user-created', {}) for _ in range(3)))
+        await client.close()
+
+    asyncio.run(run())
+    assert [r[0] for r in local_server.received].count('GET') == 1
+
+
+def _paginated(local_server):
+    def reply(handler):
+        if handler.command != 'GET':
+            return 201, {}
+        if 'page=2' in handler.path:
+            return 200, {'results': STREAMS[1:], 'next': None}
+        return 200, {'results': STREAMS[:1], 'next': f'{local_server.url}/api/o/bitcaster/a/38/s/?page=2'}
+    return reply
+
+
+def test_fetch_streams_paginated(local_server):
+    local_server.reply = _paginated(local_server)
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/')
+    client.send('user-deleted', {})
+    assert [r[:2] for r in local_server.received] == [
+        ('GET', '/api/o/bitcaster/a/38/s/'),
+        ('GET', '/api/o/bitcaster/a/38/s/?page=2'),
+        ('POST', '/api/o/bitcaster/a/38/s/2/trigger/')]
+
+
+def test_async_fetch_streams_paginated(local_server):
+    from bitcaster_sdk.aio import AsyncClient
+
+    local_server.reply = _paginated(local_server)
+
+    async def run():
+        client = AsyncClient(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/')
+        ret = await client.fetch_streams()
+        await client.close()
+        return ret
+
+    assert asyncio.run(run()) == STREAMS
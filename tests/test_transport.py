@@ -0,0 +1,76 @@
+import os
+import threading
+from time import sleep, time
+
+import pytest
+
+from bitcaster_sdk.exceptions import DeadlineExceeded, RequestTimeout
+from bitcaster_sdk.transport import Transport
+
+
+def test_post_does_not_touch_session_headers(local_server):
+    transport = Transport(f'{local_server.url}/api/o/bitcaster/a/38/', 'abc')
+    before = dict(transport.session.headers)
+    res = transport.post('s/1/trigger/', {'a': 1})
+    assert res.status_code == 201
+    assert dict(transport.session.headers) == before
+    method, path, headers, body = local_server.received[0]
+    assert headers['Content-Type'] == 'application/json'
+    assert headers['Authorization'] == 'Key abc'
+
+
+def test_pool_stats(local_server):
+    transport = Transport(f'{local_server.url}/api/o/bitcaster/a/38/', 'abc', pool_maxsize=4)
+    assert transport.adapter._pool_maxsize == 4
+    for i in range(3):
+        transport.post('s/1/trigger/', {})
+    stats = transport.pool_stats()
+    assert stats['requests'] == 3
+    assert stats['opened'] == 1
+    assert stats['reused'] == 2
+
+
+def test_concurrent_posts(local_server):
+    transport = Transport(f'{local_server.url}/api/o/bitcaster/a/38/', 'abc', pool_maxsize=4)
+    results = []
+
+    def send():
+        for i in range(5):
+            results.append(transport.post('s/1/trigger/', {}).status_code)
+
+    threads = [threading.Thread(target=send) for __ in range(4)]
+    [t.start() for t in threads]
+    [t.join() for t in threads]
+    assert results == [201] * 20
+    assert transport.pool_stats()['opened'] <= 4
+    assert 'Content-Type' not in transport.session.headers
+
+
+def test_read_timeout(local_server):
+    def slow(handler):
+        sleep(0.5)
+        return 201, {}
+
+    local_server.reply = slow
+    transport = Transport(f'{local_server.url}/api/o/bitcaster/a/38/', 'abc', read_timeout=0.1)
+    with pytest.raises(RequestTimeout):
+        transport.post('s/1/trigger/', {})
+
+
+def test_deadline(local_server):
+    transport = Transport(f'{local_server.url}/api/o/bitcaster/a/38/', 'abc')
+    with pytest.raises(DeadlineExceeded):
+        transport.post('s/1/trigger/', {}, deadline=time() - 1)
+    assert transport.post('s/1/trigger/', {}, deadline=time() + 5).status_code == 201
+    assert not local_server.received[1:]
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires os.register_at_fork')
+def test_fork_new_session():
+    transport = Transport('http://localhost:8000/api/o/bitcaster/a/38/', 'key-1', pool_maxsize=3)
+    parent = id(transport.session)
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if id(transport.session) != parent and transport.adapter._pool_maxsize == 3 else 1)
+    assert os.waitpid(pid, 0)[1] == 0
+    assert id(transport.session) == parent
@@ -0,0 +1,504 @@
+import os
+import threading
+from queue import Full
+from time import sleep, time
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from bitcaster_sdk.worker import (BackgroundWorker, BatchWorker, PooledWorker,
+                                  dispatch_concurrent)
+
+
+def test_batch_worker_groups_events():
+    batches = []
+    done = threading.Event()
+
+    def on_batch(result):
+        batches.append(result)
+        if sum(len(b.sent) for b in batches) == 5:
+            done.set()
+
+    worker = BatchWorker({'batch_size': 3, 'batch_interval': 500, 'on_batch': on_batch})
+    for i in range(5):
+        worker.submit(lambda: None)
+    assert done.wait(5)
+    assert [len(b) for b in batches] == [3, 2]
+    worker.terminate()
+
+
+def test_batch_worker_reports_failures():
+    results = []
+    done = threading.Event()
+
+    def fail():
+        raise ValueError()
+
+    def on_batch(result):
+        results.append(result)
+        done.set()
+
+    worker = BatchWorker({'batch_size': 2, 'batch_interval': 500, 'on_batch': on_batch})
+    ok = lambda: None  # noqa
+    worker.submit(ok)
+    worker.submit(fail)
+    assert done.wait(5)
+    assert results[0].sent == [ok]
+    assert results[0].failed[0][0] is fail
+    assert isinstance(results[0].failed[0][1], ValueError)
+    worker.terminate()
+
+
+def test_pooled_worker_slow_callback_does_not_stall():
+    release = threading.Event()
+    done = threading.Event()
+    sent = []
+
+    def slow():
+        release.wait(5)
+
+    def fast():
+        sent.append(1)
+        if len(sent) == 3:
+            done.set()
+
+    worker = PooledWorker({'min_threads': 2, 'max_threads': 3, 'scale_threshold': 1})
+    worker.submit(slow)
+    for __ in range(3):
+        worker.submit(fast)
+    assert done.wait(5)
+    health = worker.health()
+    assert 2 <= len(health) <= 3
+    assert any(h['busy_for'] > 0 for h in health)
+    release.set()
+    worker.terminate()
+
+
+def test_retry_does_not_delay_healthy_events():
+    sent = []
+    dead = []
+    done = threading.Event()
+
+    def failing():
+        raise ConnectionError()
+
+    def healthy():
+        sent.append(time())
+
+    def dead_letter(callback, exc):
+        dead.append((callback, exc, time()))
+        done.set()
+
+    worker = BackgroundWorker({'backoff': 0.2, 'max_attempts': 3, 'dead_letter': dead_letter})
+    start = time()
+    worker.submit(failing)
+    for __ in range(3):
+        worker.submit(healthy)
+    assert done.wait(5)
+    assert len(sent) == 3
+    assert max(sent) - start < 0.1
+    assert dead[0][0] is failing
+    assert isinstance(dead[0][1], ConnectionError)
+    # two retries: 0.1-0.2s then 0.2-0.4s
+    assert dead[0][2] - start >= 0.3
+    assert worker.retries == 0
+    assert worker._timed_queue_join(1)
+    worker.terminate()
+
+
+def test_backoff_is_capped():
+    worker = BackgroundWorker({'backoff': 1, 'max_backoff': 8})
+    assert 0.5 <= worker.backoff(1) <= 1
+    assert 4 <= worker.backoff(10) <= 8
+
+
+def _blocked_worker(options):
+    # a worker whose thread is stuck on the first event
+    release = threading.Event()
+    worker = BackgroundWorker(options)
+    worker.submit(lambda: release.wait(5))
+    while worker._queue.qsize():
+        pass
+    return worker, release
+
+
+def test_overflow_drop_oldest():
+    worker, release = _blocked_worker({'queue_size': 2, 'overflow': 'drop_oldest'})
+    callbacks = [lambda: None for __ in range(4)]
+    for c in callbacks:
+        worker.submit(c)
+    assert list(worker._queue.queue) == callbacks[2:]
+    assert worker.dropped['oldest'] == 2
+    release.set()
+    worker.terminate()
+
+
+def test_overflow_drop_newest_and_block():
+    worker, release = _blocked_worker({'queue_size': 1, 'overflow': 'block', 'block_timeout': 0.1})
+    worker.submit(lambda: None)
+    start = time()
+    worker.submit(lambda: None)
+    assert time() - start >= 0.1
+    assert worker.dropped['timeout'] == 1
+    release.set()
+    worker.terminate()
+
+
+def test_queue_bytes_limit():
+    class Sized:
+        size = 100
+
+        def __call__(self):
+            pass
+
+    worker, release = _blocked_worker({'queue_size': 100, 'queue_bytes': 250})
+    for __ in range(5):
+        worker.submit(Sized())
+    assert worker._queue.qsize() == 2
+    assert worker.dropped['newest'] == 3
+    release.set()
+    assert worker._timed_queue_join(2)
+    assert worker._bytes == 0
+    worker.terminate()
+
+
+def test_overflow_spill(tmp_path, local_server):
+    from bitcaster_sdk.client import Client
+    from bitcaster_sdk.spool import Spool
+
+    release = threading.Event()
+    worker = BackgroundWorker({'queue_size': 1, 'overflow': 'spill', 'spool': Spool(str(tmp_path))})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker)
+    worker.submit(lambda: release.wait(5))
+    while worker._queue.qsize():
+        pass
+    for i in range(5):
+        client.queue(26, {'i': i})
+    assert worker.spilled == 4
+    release.set()
+    assert worker._timed_queue_join(2)
+    for __ in range(20):
+        if len(local_server.received) == 5:
+            break
+        sleep(0.1)
+    assert sorted(r[3] for r in local_server.received) == [b'{"i": %d}' % i for i in range(5)]
+    worker.terminate()
+
+
+def test_lane_queue_weighted_fair():
+    from bitcaster_sdk.worker import LaneQueue
+
+    lanes = {'high': {'weight': 3}, 'low': {'weight': 1, 'size': 5}}
+    queue = LaneQueue(0, lanes, classify=lambda item: item[0])
+    for i in range(8):
+        queue.put_nowait(('high', i))
+    for i in range(5):
+        queue.put_nowait(('low', i))
+    with pytest.raises(Full):
+        queue.put_nowait(('low', 5))
+    order = [queue.get_nowait()[0] for __ in range(8)]
+    # low is served once every 4 items: never starved by a busy high lane
+    assert order == ['high', 'high', 'low', 'high', 'high', 'high', 'low', 'high']
+    assert queue.sizes() == {'high': 2, 'low': 3}
+
+
+def test_priority_lanes():
+    worker, release = _blocked_worker({'lanes': {'otp': {'weight': 10}, 'default': {'weight': 1, 'size': 2}},
+                                       'stream_lanes': {1: 'otp'}, 'overflow': 'drop_oldest'})
+    sent = []
+
+    def event(stream, lane=None):
+        def callback():
+            sent.append(stream)
+        callback.stream, callback.lane = stream, lane
+        return callback
+
+    for stream in (2, 3, 4):
+        worker.submit(event(stream))
+    worker.submit(event(1))
+    worker.submit(event(5, lane='otp'))
+    assert worker._queue.sizes() == {'otp': 2, 'default': 2}
+    assert worker.dropped['oldest'] == 1
+    release.set()
+    assert worker._timed_queue_join(2)
+    assert sent == [1, 5, 3, 4]
+    worker.terminate()
+
+
+def test_stream_lanes_by_slug(local_server):
+    from bitcaster_sdk.client import Client, Event
+
+    worker = BackgroundWorker({'lanes': {'otp': {'weight': 10}, 'bulk': {'weight': 1}, 'default': {'weight': 2}},
+                               'stream_lanes': {'otp-sent': 'otp', 31: 'bulk'}})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker)
+    client.streams.update([{'id': 12, 'slug': 'otp-sent', 'name': 'OTP sent'},
+                           {'id': 31, 'slug': 'digest', 'name': 'Digest'}])
+    assert worker.lane_of(Event(client, 12, {})) == 'otp'
+    assert worker.lane_of(Event(client, 'OTP sent', {})) == 'otp'
+    assert worker.lane_of(Event(client, 'digest', {})) == 'bulk'
+    assert worker.lane_of(Event(client, 'unknown', {})) == 'default'
+    assert worker.lane_of(Event(client, 7, {})) == 'default'
+    client.terminate()
+
+
+def _fork(child):
+    # runs `child()` in a forked process, returns its exit code
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os._exit(0 if child() else 1)
+        except BaseException:
+            os._exit(2)
+    return os.waitpid(pid, 0)[1] >> 8
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires os.register_at_fork')
+def test_fork_discard():
+    worker, release = _blocked_worker({})
+    for __ in range(3):
+        worker.submit(lambda: None)
+    assert _fork(lambda: worker._queue.qsize() == 0 and not worker._queue.unfinished_tasks) == 0
+    assert worker._queue.qsize() == 3
+    release.set()
+    assert worker._timed_queue_join(2)
+    worker.terminate()
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires os.register_at_fork')
+def test_fork_handoff():
+    worker, release = _blocked_worker({'fork_policy': 'handoff'})
+    r, w = os.pipe()
+    for __ in range(3):
+        worker.submit(lambda: os.write(w, b'x'))
+    assert _fork(lambda: worker._timed_queue_join(2)) == 0
+    # the child sent them, the parent does not
+    assert os.read(r, 10) == b'xxx'
+    assert worker._queue.sizes() == {'default': 0}
+    release.set()
+    assert worker._timed_queue_join(2)
+    worker.terminate()
+    os.close(r)
+    os.close(w)
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires os.register_at_fork')
+def test_fork_spill(local_server, tmp_path):
+    from bitcaster_sdk.client import Client, Event
+    from bitcaster_sdk.spool import Spool
+
+    worker = BackgroundWorker({'queue_size': 1, 'overflow': 'spill', 'spool': Spool(str(tmp_path))})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker)
+
+    def child():
+        # no spool in the child: a full queue drops instead of spilling
+        release = threading.Event()
+        worker.submit(lambda: release.wait(5))
+        while worker._queue.qsize():
+            pass
+        for __ in range(3):
+            worker.submit(Event(client, 26, {}))
+        release.set()
+        return worker.dropped['newest'] == 2 and worker.options['overflow'] == 'drop_newest'
+
+    assert _fork(child) == 0
+    assert worker.options['overflow'] == 'spill'
+    client.terminate()
+
+
+@pytest.mark.skipif(not hasattr(os, 'register_at_fork'), reason='requires os.register_at_fork')
+def test_fork_held_locks():
+    from bitcaster_sdk import metrics
+    from bitcaster_sdk.cache import ResponseCache
+    from bitcaster_sdk.calllog import CallLog
+    from bitcaster_sdk.client import Coalescer
+
+    # locks held by parent threads at fork time are never released in the child
+    owners = [Coalescer(10), CallLog(), ResponseCache(), metrics.registry, metrics.SENT]
+    for owner in owners:
+        owner._lock.acquire()
+    try:
+        assert _fork(lambda: all(owner._lock.acquire(timeout=1) for owner in owners)) == 0
+    finally:
+        for owner in owners:
+            owner._lock.release()
+
+
+def test_atexit_registered_once(monkeypatch):
+    import atexit
+
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    worker = BackgroundWorker()
+    worker.start()
+    worker._thread_for_pid = None  # as after a fork
+    worker.start()
+    assert len(registered) == 1
+    worker.terminate()
+
+
+def test_dispatch_concurrent(local_server):
+    from bitcaster_sdk.client import Client, Event
+    from bitcaster_sdk.worker import _pool_size
+
+    def fail():
+        raise ValueError()
+
+    batch = [lambda: sleep(0.1) for __ in range(8)] + [fail]
+    start = time()
+    result = dispatch_concurrent(batch, max_workers=4)
+    # one at a time would take 0.8 seconds
+    assert time() - start < 0.6
+    assert result.sent == batch[:8]
+    assert [callback for callback, __ in result.failed] == [fail]
+
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', pool_maxsize=4)
+    events = [Event(client, 26, {'n': i}) for i in range(6)]
+    assert _pool_size(events) == 4
+    assert len(dispatch_concurrent(events).sent) == 6
+    assert len(local_server.received) == 6
+
+
+def test_batch_executor(local_server):
+    from bitcaster_sdk.client import Client
+
+    worker = BatchWorker({'batch_size': 5, 'batch_interval': 20})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker, pool_maxsize=4)
+    for i in range(5):
+        client.queue(26, {'n': i})
+    assert client.flush(5)['pending'] == 0
+    executor = worker._executor
+    assert executor._max_workers == 4
+    for i in range(5):
+        client.queue(26, {'n': i})
+    assert client.flush(5)['pending'] == 0
+    # the same sender threads for every batch
+    assert worker._executor is executor
+    assert len(local_server.received) == 10
+    client.terminate(5)
+    assert worker._executor is None
+
+
+def test_empty():
+    worker, release = _blocked_worker({})
+    worker.submit(lambda: None)
+    assert not worker.empty()
+    release.set()
+    worker.flush(5)
+    assert worker.empty()
+    worker.terminate()
+
+    worker = BatchWorker({'batch_size': 10, 'batch_interval': 500})
+    worker.submit(lambda: None)
+    # collected in the current batch, not sent yet
+    assert not worker.empty()
+    worker.flush(5)
+    assert worker.empty()
+    worker.terminate()
+
+
+def test_flush_parallel():
+    worker = BackgroundWorker({'drain_threads': 4})
+    for __ in range(8):
+        worker.submit(lambda: sleep(0.1))
+    start = time()
+    assert worker.flush(5) == {'sent': 8, 'failed': 0, 'pending': 0}
+    # one sender would take 0.8 seconds
+    assert time() - start < 0.6
+    worker.terminate()
+
+
+def test_flush_schedules_retry():
+    attempts = []
+
+    def fail_once():
+        attempts.append(threading.current_thread())
+        if len(attempts) == 1:
+            raise ConnectionError()
+
+    worker = BackgroundWorker({'backoff': 0.05, 'drain_threads': 1})
+    worker.submit(lambda: None)
+    assert worker.flush(1)['pending'] == 0
+    # queued without waking up the (idle) worker thread: flush() sends it
+    with worker._queue.mutex:
+        worker._queue._put(fail_once)
+        worker._queue.unfinished_tasks += 1
+    assert worker.flush(0.02) == {'sent': 0, 'failed': 0, 'pending': 1}
+    assert attempts == [threading.current_thread()]
+    for __ in range(50):
+        if worker.empty():
+            break
+        sleep(0.02)
+    assert len(attempts) == 2
+    assert attempts[1] is worker._thread
+    worker.terminate()
+
+
+def test_shutdown_spill():
+    spilled = []
+    worker, release = _blocked_worker({'drain_threads': 1, 'max_attempts': 1, 'shutdown_spill': spilled.extend})
+
+    def fail():
+        raise ValueError()
+
+    worker.submit(fail)
+    callbacks = [lambda: sleep(0.1) for __ in range(5)]
+    for c in callbacks:
+        worker.submit(c)
+    result = worker.shutdown(0.25)
+    assert result['failed'] == 1
+    assert result['sent'] + result['abandoned'] == 5
+    assert result['abandoned'] > 0
+    assert spilled == callbacks[-result['abandoned']:]
+    assert worker._queue.sizes() == {'default': 0}
+    release.set()
+
+
+def test_retry_server_error(local_server):
+    from bitcaster_sdk.client import Client
+
+    replies = [(500, {}), (201, {})]
+    local_server.reply = lambda handler: replies.pop(0)
+    dead = []
+    worker = BackgroundWorker({'backoff': 0.01, 'dead_letter': lambda c, e: dead.append(e)})
+    client = Client(f'http://key-1@{local_server.url[7:]}/api/o/bitcaster/a/38/', worker=worker)
+    client.queue(26, {'a': 1})
+    assert client.flush(5) == {'sent': 1, 'failed': 0, 'pending': 0}
+    assert len(local_server.received) == 2
+    assert dead == []
+    client.terminate()
+
+
+def test_retries_count_against_queue_size():
+    def fail():
+        raise ConnectionError()
+
+    worker = BackgroundWorker({'queue_size': 3, 'backoff': 10})
+    for __ in range(3):
+        worker.submit(fail)
+    for __ in range(50):
+        if worker.retries == 3:
+            break
+        sleep(0.02)
+    assert worker.retries == 3
+    worker.submit(lambda: None)
+    assert worker.dropped['newest'] == 1
+    worker.terminate()
+
+
+@pytest.mark.parametrize('worker_class', [BackgroundWorker, BatchWorker])
+def test_throttled_gives_up(worker_class):
+    from bitcaster_sdk.exceptions import RateLimited
+
+    calls, dead = [], []
+
+    def throttled():
+        calls.append(1)
+        raise RateLimited({'time_left': 0.01})
+
+    worker = worker_class({'max_throttled': 3, 'batch_interval': 10, 'dead_letter': lambda c, e: dead.append(e)})
+    worker.submit(throttled)
+    assert worker._timed_queue_join(5)
+    assert len(calls) == 4
+    assert isinstance(dead[0], RateLimited)
+    assert worker._throttled == {}
+    worker.terminate()